@@ -1,18 +1,28 @@
-from openai import OpenAI
 import re
 import weave
 from datetime import datetime
 from agent_design_review import design_review
 from agent_figma_extract import extract_figma_images
-from agent_tone_review import tone_text_copy_review
+from agent_tone_review import tone_text_copy_review, tone_text_copy_review_batch
 from agent_pr_lookup import lookup_prs
 from more_info_agent import get_more_info
+from llm_clients import get_client
+from background import stream_ordered
+from pre_router import EXTRACT_ACTION, pre_route
+from settings_cache import AppSettings
+from speculation import SpeculativeStream
+from streaming import completion_deltas, normalize_stream
+from context import build_messages
+import frame_changes
 from logger import logger
 
+# Router tags that hand the turn to a tool instead of the conversation
+TOOL_TAG_PATTERN = r'<(extract_images_from_figma|more_info_needed|review_design|tone_text_copy_review|pr_lookup)\b'
+
 @weave.op()
 def gen_thread_title(api_endpoint: str, api_key: str, api_model: str, message: str):
     """Generate a title for a thread based on the initial message."""
-    client = OpenAI(base_url=api_endpoint, api_key=api_key)
+    client = get_client(api_endpoint, api_key)
     system_prompt = """
 You are an AI that generates concise, descriptive titles based on the given question.
 Your response must be in the format: <title>Generated title here</title>. "
@@ -73,7 +83,7 @@ Do not include any additional prose, explanations, or formatting beyond the tags
 
 ### Design review from images
 - You have the ability to do design reviews on image links from Figma.
-- Figma image links will be in a Figma-based S3 bucket, but will not contain an extension.
+- Figma image links will either be local links of the form /api/image/[HASH] or in a Figma-based S3 bucket, and will not contain an extension.
 - You must have the images extracted first, if the user asks for a design review please run `extract_images_from_figma` first to gather the images for them.
 - You can have multiple images in your response.
 - Format: <review_design>[FIGMA_IMAGE_URL]</review_design> <review_design>[FIGMA_IMAGE_URL2]</review_design>
@@ -81,7 +91,7 @@ Do not include any additional prose, explanations, or formatting beyond the tags
 
 ### Tone of voice, text-copy review from images
 - You have the ability to do tone of voice reviews on text copy from image links from Figma.
-- Figma image links will be in a Figma-based S3 bucket, but will not contain an extension.
+- Figma image links will either be local links of the form /api/image/[HASH] or in a Figma-based S3 bucket, and will not contain an extension.
 - You must have the images extracted first, if the user asks for a tone review please run `extract_images_from_figma` first to gather the images for them.
 - You can have multiple images in your response.
 - Format: <tone_text_copy_review>[FIGMA_IMAGE_URL]</tone_text_copy_review> <tone_text_copy_review>[FIGMA_IMAGE_URL2]</tone_text_copy_review>
@@ -97,6 +107,7 @@ Do not include any additional prose, explanations, or formatting beyond the tags
     <end_date>[End date:optional]</end_date>
     <author>[Author name:optional]</author>
     <search_term>[Search term:required]</search_term>
+    <sort>[recent or relevance:optional]</sort>
 </pr_lookup>
 - Example: 
 <pr_lookup>
@@ -122,20 +133,9 @@ Do not include any additional prose, explanations, or formatting beyond the tags
 - If a feature requires credentials that are disabled, return <more_info/>.
         """.strip()
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-        ]
-        if thread_messages:
-            logger.debug(f"Adding {len(thread_messages)} messages to context")
-            for msg in thread_messages:
-                if not msg["message"].strip():
-                    continue
-                messages.append({
-                    "role": msg["sender"].lower(),
-                    "content": msg["message"]
-                })
-                logger.debug(f"Added message from {msg['sender']}: {msg['message'][:100]}...")
-        
+        messages, _ = build_messages("router", api_model, thread_messages, system_prompt)
+        logger.debug(f"Router context has {len(messages) - 1} of {len(thread_messages or [])} messages")
+
         logger.info("Calling router completion...")
         response = client.chat.completions.create(
             model=api_model,
@@ -150,25 +150,44 @@ Do not include any additional prose, explanations, or formatting beyond the tags
         return error
 
 @weave.op()
-def gen_streaming_response(api_endpoint: str, api_key: str, api_model: str, message: str, thread_messages: list = None, figma_token: str = None, github_token: str = None):
+def gen_streaming_response(settings: AppSettings, message: str, thread_messages: list = None, route_info: dict = None, frame_reviews: dict = None):
+    api_endpoint = settings.api_endpoint
+    api_key = settings.api_key
+    api_model = settings.api_model
+    figma_token = settings.figma_token
+    github_token = settings.github_token
+    review_concurrency = settings.review_concurrency
     try:
-        client = OpenAI(base_url=api_endpoint, api_key=api_key)
-        logger.info("Initialized OpenAI client")
+        client = get_client(api_endpoint, api_key)
+        logger.info("Using pooled OpenAI client")
         
-        messages = []
-        if thread_messages:
-            logger.debug(f"Processing {len(thread_messages)} messages for context")
-            for msg in thread_messages:
-                if not msg["message"].strip():
-                    continue
-                messages.append({
-                    "role": msg["sender"].lower(),
-                    "content": msg["message"]
-                })        
+        messages, _ = build_messages("conversation", api_model, thread_messages)
 
         ## -- Routing -- ##
-        logger.info("Getting routing response")
-        routing_response = gen_router(client, api_model, thread_messages, figma_token, github_token)
+        if route_info is None:
+            route_info = {}
+        decision = pre_route(message, thread_messages, figma_token, github_token)
+        speculation = None
+        if decision:
+            logger.info(f"Pre-router decision ({decision.rule}): {decision.routing_response}")
+            routing_response = decision.routing_response
+            route_info.update({"path": "pre_router", "rule": decision.rule})
+        else:
+            if settings.speculative_streaming:
+                # Start the conversational answer while the router decides
+                speculation = SpeculativeStream(client, api_model, messages + [{"role": "user", "content": message}])
+            logger.info("Getting routing response")
+            routing_response = gen_router(client, api_model, thread_messages, figma_token, github_token)
+            route_info.update({"path": "llm_router"})
+
+        is_conversation = (
+            not re.search(TOOL_TAG_PATTERN, routing_response)
+            and ('<continue_conversation/>' in routing_response or routing_response.strip() == '')
+        )
+        if speculation and not is_conversation:
+            speculation.cancel()
+            speculation = None
+        route_info["speculative"] = speculation is not None
         handled = False
 
         # Handle Figma image extraction
@@ -176,13 +195,14 @@ def gen_streaming_response(api_endpoint: str, api_key: str, api_model: str, mess
         figma_urls = re.findall(figma_pattern, routing_response)
         if figma_urls and not handled:
             handled = True
+            route_info["action"] = EXTRACT_ACTION
             logger.info("Processing Figma image extraction")
             if not figma_token:
                 logger.warning("Figma token not configured")
                 yield "Error: Figma token not configured in settings\n\n"
             else:
                 try:
-                    for content in extract_figma_images(figma_token, figma_urls[0]):
+                    for content in extract_figma_images(figma_token, figma_urls[0], scale=settings.figma_export_scale, image_format=settings.figma_export_format):
                         yield content
                 except Exception as e:
                     logger.error(f"Error extracting Figma images: {str(e)}")
@@ -191,15 +211,15 @@ def gen_streaming_response(api_endpoint: str, api_key: str, api_model: str, mess
         # Handle more info needed
         if '<more_info_needed/>' in routing_response and not handled:
             handled = True
+            route_info["action"] = "more_info_needed"
             logger.info("Processing more info needed request")
             try:
-                for content in get_more_info(
+                yield from get_more_info(
                     api_endpoint=api_endpoint,
                     api_key=api_key,
                     api_model=api_model,
                     thread_messages=thread_messages
-                ):
-                    yield content + "\n"
+                )
             except Exception as e:
                 logger.error(f"Error processing more info request: {str(e)}")
                 yield f"Error processing more info request: {str(e)}\n\n"
@@ -209,60 +229,120 @@ def gen_streaming_response(api_endpoint: str, api_key: str, api_model: str, mess
         frame_urls = re.findall(frame_pattern, routing_response)
         if frame_urls and not handled:
             handled = True
-            logger.info("Processing design review")
+            route_info["action"] = "review_design"
             total_designs = len(frame_urls)
-            for idx, url in enumerate(frame_urls):
-                if idx == 0:
-                    yield f"> Reviewing {url} (1 of {total_designs})...\n\n"
-                else:
-                    yield f"\n\n> Reviewing {url} ({idx + 1} of {total_designs})...\n\n"
-                try:
-                    for content in design_review(
-                        image_url=url,
-                        api_endpoint=api_endpoint,
-                        api_key=api_key,
-                        api_model=api_model,
-                        thread_messages=thread_messages
-                    ):
-                        # Only add a newline if the content doesn't already end with one
-                        if content:
-                            yield content if content.endswith('\n') else content + ' '
-                except Exception as e:
-                    logger.error(f"Error processing design review for URL {idx + 1}: {str(e)}")
-                    yield f"Error processing design review for URL {idx + 1}: {str(e)}\n\n"
+            states = [frame_changes.frame_state(url) for url in frame_urls]
+            previous = [frame_changes.previous_review(frame_reviews, frame_changes.DESIGN_REVIEW, state) for state in states]
+            skipped = sum(1 for output in previous if output)
+            logger.info(f"Processing design review for {total_designs} frame(s), {skipped} unchanged, up to {review_concurrency} in parallel")
+            if skipped:
+                yield f"> {skipped} of {total_designs} frame(s) unchanged since the last review, reusing their reviews\n\n"
+
+            def review_frame(idx, url):
+                def run():
+                    prefix = "" if idx == 0 else "\n\n"
+                    if previous[idx]:
+                        yield f"{prefix}> Skipped {states[idx]['name']} ({idx + 1} of {total_designs}), unchanged since the last review\n\n"
+                        yield previous[idx]
+                        return
+                    yield f"{prefix}> Reviewing {url} ({idx + 1} of {total_designs})...\n\n"
+                    try:
+                        output = []
+                        for chunk in design_review(
+                            image_url=url,
+                            api_endpoint=api_endpoint,
+                            api_key=api_key,
+                            api_model=api_model,
+                            thread_messages=thread_messages
+                        ):
+                            output.append(chunk)
+                            yield chunk
+                        frame_changes.record_review(frame_reviews, frame_changes.DESIGN_REVIEW, states[idx], "".join(output))
+                    except Exception as e:
+                        logger.error(f"Error processing design review for URL {idx + 1}: {str(e)}")
+                        yield f"Error processing design review for URL {idx + 1}: {str(e)}\n\n"
+                return run
+
+            # Frames are reviewed in parallel but streamed back in order
+            yield from stream_ordered(
+                [review_frame(idx, url) for idx, url in enumerate(frame_urls)],
+                max_concurrency=review_concurrency
+            )
 
         # Handle tone and text copy review
         tone_pattern = r'<tone_text_copy_review>(.*?)</tone_text_copy_review>'
         tone_urls = re.findall(tone_pattern, routing_response)
         if tone_urls and not handled:
             handled = True
-            logger.info("Processing tone and text copy review")
+            route_info["action"] = "tone_text_copy_review"
+            states = {url: frame_changes.frame_state(url) for url in tone_urls}
+            previous = {url: frame_changes.previous_review(frame_reviews, frame_changes.TONE_REVIEW, states[url]) for url in tone_urls}
+
+            # Frames unchanged since their last tone review are replayed, only the rest go to the model
+            unchanged_urls = [url for url in tone_urls if previous[url]]
+            if unchanged_urls:
+                yield f"> {len(unchanged_urls)} of {len(tone_urls)} frame(s) unchanged since the last review, reusing their reviews\n\n"
+                for url in unchanged_urls:
+                    yield f"> Skipped {states[url]['name']}, unchanged since the last review\n\n"
+                    yield previous[url] + "\n\n"
+            tone_urls = [url for url in tone_urls if not previous[url]]
+
+            def record_tone_review(url, output):
+                frame_changes.record_review(frame_reviews, frame_changes.TONE_REVIEW, states[url], output)
+
             total_designs = len(tone_urls)
-            for idx, url in enumerate(tone_urls):
-                if idx == 0:
-                    yield f"> Analyzing text copy in {url} (1 of {total_designs})...\n\n"
-                else:
-                    yield f"\n\n> Analyzing text copy in {url} ({idx + 1} of {total_designs})...\n\n"
-                try:
-                    for content in tone_text_copy_review(
-                        image_url=url,
-                        api_endpoint=api_endpoint,
-                        api_key=api_key,
-                        api_model=api_model,
-                        thread_messages=thread_messages
-                    ):
-                        # Only add a newline if the content doesn't already end with one
-                        if content:
-                            yield content if content.endswith('\n') else content + ' '
-                except Exception as e:
-                    logger.error(f"Error processing tone review for URL {idx + 1}: {str(e)}")
-                    yield f"Error processing tone review for URL {idx + 1}: {str(e)}\n\n"
+            batch_size = settings.tone_batch_size
+            batches = [tone_urls[start:start + batch_size] for start in range(0, total_designs, batch_size)]
+            logger.info(f"Processing tone and text copy review for {total_designs} frame(s) in {len(batches)} batch(es), {len(unchanged_urls)} unchanged")
+
+            def review_batch(idx, urls):
+                def run():
+                    first = idx * batch_size + 1
+                    prefix = "" if idx == 0 else "\n\n"
+                    if len(urls) == 1:
+                        yield f"{prefix}> Analyzing text copy in {urls[0]} ({first} of {total_designs})...\n\n"
+                        review = tone_text_copy_review(
+                            image_url=urls[0],
+                            api_endpoint=api_endpoint,
+                            api_key=api_key,
+                            api_model=api_model,
+                            thread_messages=thread_messages
+                        )
+                    else:
+                        last = first + len(urls) - 1
+                        yield f"{prefix}> Analyzing text copy in frames {first}-{last} of {total_designs}...\n\n"
+                        review = tone_text_copy_review_batch(
+                            image_urls=urls,
+                            api_endpoint=api_endpoint,
+                            api_key=api_key,
+                            api_model=api_model,
+                            thread_messages=thread_messages,
+                            on_review=record_tone_review
+                        )
+                    try:
+                        output = []
+                        for chunk in review:
+                            output.append(chunk)
+                            yield chunk
+                        if len(urls) == 1:
+                            record_tone_review(urls[0], "".join(output))
+                    except Exception as e:
+                        logger.error(f"Error processing tone review for batch {idx + 1}: {str(e)}")
+                        yield f"Error processing tone review for batch {idx + 1}: {str(e)}\n\n"
+                return run
+
+            # Batches are processed in parallel but streamed back in order
+            yield from stream_ordered(
+                [review_batch(idx, urls) for idx, urls in enumerate(batches)],
+                max_concurrency=review_concurrency
+            )
 
         # Handle GitHub PRs
         pr_pattern = r'<pr_lookup>(.*?)</pr_lookup>'
         pr_matches = re.findall(pr_pattern, routing_response, re.DOTALL)
         if pr_matches and not handled:
             handled = True
+            route_info["action"] = "pr_lookup"
             if not github_token:
                 logger.warning("GitHub token not configured")
                 yield "Error: GitHub token not configured in settings\n\n"
@@ -293,8 +373,13 @@ def gen_streaming_response(api_endpoint: str, api_key: str, api_model: str, mess
                         search_term_match = re.search(r'<search_term>(.*?)</search_term>', pr_matches[0])
                         if search_term_match:
                             pr_data['search_term'] = search_term_match.group(1)
+
+                        # Extract sort order
+                        sort_match = re.search(r'<sort>(.*?)</sort>', pr_matches[0])
+                        if sort_match:
+                            pr_data['sort'] = sort_match.group(1)
                     
-                    for content in lookup_prs(github_token, pr_data):
+                    for content in lookup_prs(github_token, pr_data, max_results=settings.pr_max_results, repositories=list(settings.github_repositories), sort=settings.pr_sort):
                         yield content
                 except Exception as e:
                     logger.error(f"Error processing PR lookup: {str(e)}")
@@ -304,42 +389,23 @@ def gen_streaming_response(api_endpoint: str, api_key: str, api_model: str, mess
         if not handled:
             if '<continue_conversation/>' in routing_response or routing_response.strip() == '':
                 logger.info("Processing conversation response")
-                messages.append({"role": "user", "content": message})
-                stream = client.chat.completions.create(
-                    model=api_model,
-                    messages=messages,
-                    stream=True
-                )
-                
-                buffer = ""
-                for chunk in stream:
-                    if chunk.choices[0].delta.content is not None:
-                        content = chunk.choices[0].delta.content
-                        # Add to buffer
-                        buffer += content
-                        
-                        # If we have a newline or sufficient content, process and yield
-                        if '\n' in buffer or len(buffer) > 80:
-                            # Split by newlines to preserve them
-                            parts = buffer.split('\n')
-                            
-                            # Process all parts except the last one
-                            for part in parts[:-1]:
-                                # Normalize spaces while preserving intentional newlines
-                                normalized = ' '.join(part.split())
-                                if normalized:
-                                    yield normalized + '\n'
-                            
-                            # Keep the last part in buffer
-                            buffer = parts[-1]
+                route_info["action"] = "continue_conversation"
+                if speculation:
+                    # The answer has been streaming since routing started
+                    deltas = speculation.commit()
+                else:
+                    messages.append({"role": "user", "content": message})
+                    stream = client.chat.completions.create(
+                        model=api_model,
+                        messages=messages,
+                        stream=True
+                    )
+                    deltas = completion_deltas(stream)
                 
-                # Process any remaining content in buffer
-                if buffer:
-                    normalized = ' '.join(buffer.split())
-                    if normalized:
-                        yield normalized
+                yield from normalize_stream(deltas)
             else:
                 logger.info("Yielding routing response as fallback")
+                route_info["action"] = "fallback"
                 yield routing_response
 
     except Exception as e:
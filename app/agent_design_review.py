@@ -1,24 +1,19 @@
 import logging
-from openai import OpenAI
+from llm_clients import get_client
+from streaming import stream_completion
+from context import build_messages, flight_history
+from vision_preprocess import vision_content
+from single_flight import SingleFlight, make_key
 from typing import Generator
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def design_review(
-    image_url: str,
-    api_endpoint: str,
-    api_key: str,
-    api_model: str,
-    thread_messages: list = None,
-) -> Generator[str, None, None]:
-    logger.info("Starting design review process...")
-    
-    try:
-        client = OpenAI(base_url=api_endpoint, api_key=api_key)
-        
-        system_prompt = """
+# Number of frames reviewed in parallel unless configured in settings
+DEFAULT_REVIEW_CONCURRENCY = 4
+
+DESIGN_REVIEW_PROMPT = """
 Instructions:
 You are an expert UI/UX designer reviewing a design.
 Provide specific, actionable feedback and suggestions for improvement.
@@ -30,29 +25,50 @@ Formatting:
 - Use bullet points when appropriate.
 """.strip()
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-        ]
+# Identical reviews running at the same time share one model call
+review_flight = SingleFlight("vision.design_review")
+
+
+def design_review(
+    image_url: str,
+    api_endpoint: str,
+    api_key: str,
+    api_model: str,
+    thread_messages: list = None,
+) -> Generator[str, None, None]:
+    """
+    Stream a design review of one image, concurrent reviews of the same image with the same thread
+    history share one in-flight stream, so one thread's context never ends up in another's review.
+    """
+    # System prompt plus as much recent thread history as fits the budget
+    messages, _ = build_messages("design_review", api_model, thread_messages, DESIGN_REVIEW_PROMPT)
+    key = make_key(api_endpoint, api_model, image_url, flight_history(messages))
+    return review_flight.stream(
+        key,
+        lambda: _design_review(image_url, api_endpoint, api_key, api_model, messages)
+    )
+
 
-        # Add thread history if available
-        if thread_messages:
-            for msg in thread_messages:
-                if not msg["message"].strip():
-                    continue
-                messages.append({
-                    "role": msg["sender"].lower(),
-                    "content": msg["message"]
-                })
+def _design_review(
+    image_url: str,
+    api_endpoint: str,
+    api_key: str,
+    api_model: str,
+    messages: list,
+) -> Generator[str, None, None]:
+    logger.info("Starting design review process...")
+    
+    try:
+        client = get_client(api_endpoint, api_key)
+        messages = list(messages)
 
-        # Add the final message with the image
+        # Add the final message with the image, downscaled or tiled for the vision model
+        image_parts, _ = vision_content(image_url)
         messages.append({
             "role": "user",
             "content": [
                 {"type": "text", "text": "Please review this design and provide detailed feedback:"},
-                {
-                    "type": "image_url",
-                    "image_url": {"url": image_url},
-                },
+                *image_parts,
             ],
         })
 
@@ -62,33 +78,7 @@ Formatting:
             stream=True
         )
 
-        buffer = ""
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                content = chunk.choices[0].delta.content
-                # Add to buffer
-                buffer += content
-                
-                # If we have a newline or sufficient content, process and yield
-                if '\n' in buffer or len(buffer) > 80:
-                    # Split by newlines to preserve them
-                    parts = buffer.split('\n')
-                    
-                    # Process all parts except the last one
-                    for part in parts[:-1]:
-                        # Normalize spaces while preserving intentional newlines
-                        normalized = ' '.join(part.split())
-                        if normalized:
-                            yield normalized + '\n'
-                    
-                    # Keep the last part in buffer
-                    buffer = parts[-1]
-        
-        # Process any remaining content in buffer
-        if buffer:
-            normalized = ' '.join(buffer.split())
-            if normalized:
-                yield normalized
+        yield from stream_completion(stream)
                 
     except Exception as e:
         logger.error(f"Error in design review: {e}")
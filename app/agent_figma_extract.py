@@ -1,73 +1,86 @@
-import requests
 import re
-import os
-import urllib.request
-from typing import Generator, Dict, List, Tuple
+from typing import Generator, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from figma_cache import FIGMA_API_URL, FIGMA_FILE_PATH, document_cache
+from frame_changes import subtree_hash
+from image_store import image_store
+from single_flight import SingleFlight, make_key
+import upstream
 from logger import logger
 
-def extract_figma_images(figma_token: str, figma_url: str) -> Generator[str, None, None]:
+# Number of rendered frames downloaded at once
+DOWNLOAD_CONCURRENCY = 4
+# Frame ids per images API call, keeps URLs short and each render job small
+EXPORT_BATCH_SIZE = 10
+# Number of export calls in flight at once
+EXPORT_CONCURRENCY = 3
+EXPORT_TIMEOUT = 120
+
+# Export settings unless configured in settings
+DEFAULT_EXPORT_SCALE = 1.0
+DEFAULT_EXPORT_FORMAT = "png"
+EXPORT_FORMATS = ("png", "jpg")
+MIN_EXPORT_SCALE = 0.01
+MAX_EXPORT_SCALE = 4.0
+
+FILE_ID_PATTERN = re.compile(FIGMA_FILE_PATH)
+NODE_ID_PATTERN = re.compile(r"node-id=([\w-]+)")
+
+# Identical extractions running at the same time share one export
+extract_flight = SingleFlight("figma.extract")
+
+
+def parse_figma_url(figma_url: str) -> Tuple[Optional[str], Optional[str]]:
+    """File id and API node id (e.g. "2133:51202") of a Figma design link."""
+    file_id_match = FILE_ID_PATTERN.search(figma_url)
+    node_id_match = NODE_ID_PATTERN.search(figma_url)
+    file_id = file_id_match.group(1) if file_id_match else None
+    node_id = node_id_match.group(1).replace("-", ":", 1) if node_id_match else None
+    return file_id, node_id
+
+
+def extract_figma_images(figma_token: str, figma_url: str, scale: float = DEFAULT_EXPORT_SCALE, image_format: str = DEFAULT_EXPORT_FORMAT) -> Generator[str, None, None]:
     """
     Extract images from Figma and return a generator that yields status updates and results.
+    Frames are rendered at `scale` (0.01-4) as `image_format` ("png" or "jpg").
+    Concurrent extractions of the same frames with the same settings share one in-flight stream.
     """
+    # Links to the same node differ in tracking parameters, key on what is exported
+    key = make_key(figma_token, parse_figma_url(figma_url), scale, (image_format or "").lower())
+    return extract_flight.stream(key, lambda: _extract_figma_images(figma_token, figma_url, scale, image_format))
+
+
+def _extract_figma_images(figma_token: str, figma_url: str, scale: float, image_format: str) -> Generator[str, None, None]:
     try:
+        image_format = (image_format or DEFAULT_EXPORT_FORMAT).lower()
+        if image_format == "jpeg":
+            image_format = "jpg"
+        if image_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format '{image_format}', use one of: {', '.join(EXPORT_FORMATS)}")
+        scale = min(max(float(scale or DEFAULT_EXPORT_SCALE), MIN_EXPORT_SCALE), MAX_EXPORT_SCALE)
+
         # Initial status update
         yield "> Extracting images from Figma...\n\n"
 
         # --- Step 1: Extract File ID and Node ID from the URL ---
-        file_id_match = re.search(r"design/([a-zA-Z0-9]+)", figma_url)
-        node_id_match = re.search(r"node-id=([\w-]+)", figma_url)
-        
-        if not (file_id_match and node_id_match):
-            raise ValueError("Could not extract the file ID or node ID from the URL.")
+        # Without a node ID the top-level frames of the first page are exported
+        file_id, api_node_id = parse_figma_url(figma_url)
 
-        file_id = file_id_match.group(1)
-        node_id = node_id_match.group(1)
-        api_node_id = node_id.replace("-", ":", 1)
+        if not file_id:
+            raise ValueError("Could not extract the file ID from the URL.")
         
         yield "> Successfully extracted file and node IDs\n\n"
 
-        # --- Step 2: Fetch the Figma file JSON ---
+        # --- Step 2: Fetch the Figma file JSON (node-scoped, cached per file version) ---
         headers = {"X-Figma-Token": figma_token}
-        figma_api_url = f"https://api.figma.com/v1/files/{file_id}"
-        response = requests.get(figma_api_url, headers=headers)
-        
-        if response.status_code != 200:
-            raise Exception(f"Error fetching Figma file: {response.text}")
-
-        data = response.json()
-        yield "> Successfully fetched Figma file data\n\n"
-
-        # --- Helper functions ---
-        def find_node(node: Dict, target_id: str) -> Dict:
-            if node.get("id") == target_id:
-                return node
-            for child in node.get("children", []):
-                result = find_node(child, target_id)
-                if result:
-                    return result
-            return None
-
-        def extract_top_level_frames(container_node: Dict) -> List[Dict]:
-            return [child for child in container_node.get("children", []) 
-                   if child.get("type") == "FRAME"]
-
-        # --- Step 3: Find frames to export ---
-        target_node = None
-        for page in data["document"]["children"]:
-            target_node = find_node(page, api_node_id)
-            if target_node:
-                break
-
-        frames = []
-        if target_node:
-            if target_node.get("type") == "FRAME":
-                frames = [target_node]
-            else:
-                frames = extract_top_level_frames(target_node)
-                if not frames:
-                    frames = extract_top_level_frames(data["document"]["children"][0])
+        index, from_cache = document_cache.get_document(file_id, api_node_id, headers)
+        if from_cache:
+            yield "> Loaded Figma file data from cache\n\n"
         else:
-            frames = extract_top_level_frames(data["document"]["children"][0])
+            yield "> Successfully fetched Figma file data\n\n"
+
+        # --- Step 3: Find frames to export (O(1) lookups in the prebuilt node index) ---
+        frames = index.frames_for(api_node_id)
 
         if not frames:
             raise Exception("No frames found to export.")
@@ -77,30 +90,86 @@ def extract_figma_images(figma_token: str, figma_url: str) -> Generator[str, Non
         # Create frame ID mapping
         frame_ids = [frame["id"] for frame in frames]
         frame_names = {frame["id"]: frame["name"] for frame in frames}
+        version = str(index.document.get("version", ""))
+        render = f"{scale:g}x.{image_format}"
 
-        # --- Step 4: Get image URLs ---
-        ids_param = ",".join(frame_ids)
-        images_api_url = f"https://api.figma.com/v1/images/{file_id}?ids={ids_param}&format=png"
-        img_response = requests.get(images_api_url, headers=headers)
-        
-        if img_response.status_code != 200:
-            raise Exception(f"Error fetching PNG URLs: {img_response.text}")
-            
-        images_data = img_response.json().get("images", {})
-        yield "> Successfully retrieved image URLs\n\n"
-
-        # --- Step 5: Generate markdown table ---
-        markdown_table = "| Frame Name | Image URL |\n| --- | --- |\n"
+        # Frames already rendered at this file version and export settings are not exported again
+        stored_urls = {}
+        for fid in frame_ids:
+            digest = image_store.lookup_node(file_id, fid, version, render)
+            if digest and image_store.resolve(image_store.local_url(digest)):
+                stored_urls[fid] = image_store.local_url(digest)
+        export_ids = [fid for fid in frame_ids if fid not in stored_urls]
+        if stored_urls:
+            yield f"> Reusing {len(stored_urls)} frame(s) already exported at this file version\n\n"
+
+        # --- Step 4: Export and download in bounded batches, rows stream as each batch resolves ---
         image_urls = []
+        failures = []
+
+        def row(fid, image_url):
+            image_urls.append(image_url)
+            return f"| {frame_names[fid]} | {image_url} |\n"
 
+        yield "| Frame Name | Image URL |\n| --- | --- |\n"
         for fid in frame_ids:
-            png_url = images_data.get(fid)
-            if png_url:
-                frame_name = frame_names[fid]
-                markdown_table += f"| {frame_name} | {png_url} |\n"
-                image_urls.append(png_url)
+            if fid in stored_urls:
+                yield row(fid, stored_urls[fid])
+
+        if export_ids:
+            batches = [export_ids[start:start + EXPORT_BATCH_SIZE] for start in range(0, len(export_ids), EXPORT_BATCH_SIZE)]
+            logger.info(f"Exporting {len(export_ids)} frame(s) in {len(batches)} batch(es) at {render}")
+
+            # Figma's S3 links expire, reviews are served from the stored bytes instead
+            def store_frame(fid, image_url):
+                # Recorded with the image so later reviews can tell whether the frame changed
+                frame = {
+                    "file_id": file_id,
+                    "node_id": fid,
+                    "version": version,
+                    "name": frame_names[fid],
+                    "subtree": subtree_hash(index.get(fid) or {}),
+                }
+                try:
+                    node_key = image_store.node_key(file_id, fid, version, render)
+                    digest = image_store.fetch(image_url, node_key=node_key, frame=frame)
+                    return fid, image_store.local_url(digest)
+                except Exception as e:
+                    logger.warning(f"Could not store image for frame {fid}: {str(e)}")
+                    return fid, image_url
+
+            with ThreadPoolExecutor(max_workers=EXPORT_CONCURRENCY) as export_pool, \
+                    ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as download_pool:
+
+                def export_batch(ids):
+                    response = upstream.get(
+                        "figma",
+                        f"{FIGMA_API_URL}/images/{file_id}",
+                        headers=headers,
+                        params={"ids": ",".join(ids), "format": image_format, "scale": scale},
+                        timeout=EXPORT_TIMEOUT,
+                    )
+                    if response.status_code != 200:
+                        raise Exception(f"Error fetching image URLs: {response.text}")
+                    images_data = response.json().get("images", {})
+                    rendered = [(fid, images_data[fid]) for fid in ids if images_data.get(fid)]
+                    return list(download_pool.map(lambda item: store_frame(*item), rendered))
+
+                futures = {export_pool.submit(export_batch, ids): ids for ids in batches}
+                for future in as_completed(futures):
+                    try:
+                        for fid, image_url in future.result():
+                            yield row(fid, image_url)
+                    except Exception as e:
+                        logger.error(f"Export batch of {len(futures[future])} frame(s) failed: {str(e)}")
+                        failures.append((futures[future], str(e)))
+
+        yield "\n\n"
+        for ids, error in failures:
+            yield f"> Could not export {len(ids)} frame(s): {error}\n\n"
+        if not image_urls:
+            raise Exception("No frames could be exported.")
 
-        yield markdown_table + "\n\n"
         yield "Your images have been successfully extracted! Would you like me to review the design now? I also have the ability to analyze the tone and copy of your designs."
         
         return image_urls
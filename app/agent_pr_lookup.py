@@ -1,175 +1,316 @@
-import requests
 import re
 import json
 from datetime import datetime
-from typing import Generator, Dict, List
+from typing import Generator, Dict, List, Optional, Tuple
+from background import merge_sorted, submit
+from github_api import FILES_BATCH_SIZE, RATE_LIMIT_FIELDS, auth_headers, graphql, prs_touching
 from logger import logger
+from pr_mirror import pr_mirror
+from single_flight import SingleFlight, make_key
 import weave
 
+# PRs per search page
+SEARCH_PAGE_SIZE = 50
+# Design-related PRs listed unless configured in settings
+DEFAULT_MAX_RESULTS = 200
+# Repositories searched unless configured in settings
+DEFAULT_REPOSITORIES = ("wandb/weave",)
+REPOSITORY_PATTERN = re.compile(r"^[\w.-]+/[\w.-]+$")
+# Number of repositories searched at once
+MAX_REPO_CONCURRENCY = 4
+
+SORT_RECENT = "recent"
+SORT_RELEVANCE = "relevance"
+SORT_ORDERS = (SORT_RECENT, SORT_RELEVANCE)
+
+# Look for frontend-related files
+FRONTEND_EXTENSIONS = ('.css', '.less', '.html', '.js', '.jsx', '.ts', '.tsx')
+
+# Phase one: lightweight PR headers, no file lists
+SEARCH_QUERY = """
+query SearchPRs($query: String!, $first: Int!, $after: String) {
+""" + RATE_LIMIT_FIELDS + """
+  search(first: $first, after: $after, query: $query, type: ISSUE) {
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+    nodes {
+      ... on PullRequest {
+        id
+        title
+        url
+        state
+        createdAt
+        updatedAt
+        additions
+        deletions
+        changedFiles
+        author {
+          ... on User {
+            login
+            name
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+# Identical lookups running at the same time share one set of GitHub requests
+pr_flight = SingleFlight("github.prs")
+
+
+def _is_frontend_file(path: str) -> bool:
+    return path.lower().endswith(FRONTEND_EXTENSIONS)
+
+
+def _sync_mirror(repo: str, headers: Dict):
+    try:
+        pr_mirror.sync(repo, headers, force=True)
+    except Exception as e:
+        logger.error(f"PR mirror sync of {repo} failed: {str(e)}")
+
+
+def parse_repositories(value: Optional[str]) -> Tuple[str, ...]:
+    """
+    Repositories from a comma or whitespace separated "owner/name" list, in order and without duplicates.
+    Raises ValueError for an entry that is not owner/name.
+    """
+    repositories = []
+    for repo in re.split(r"[\s,]+", value or ""):
+        repo = repo.strip().strip("/")
+        if not repo:
+            continue
+        if not REPOSITORY_PATTERN.match(repo):
+            raise ValueError(f"'{repo}' is not an owner/name repository")
+        if repo.lower() not in [known.lower() for known in repositories]:
+            repositories.append(repo)
+    return tuple(repositories) or DEFAULT_REPOSITORIES
+
+
+def _created_timestamp(pr: Dict) -> float:
+    return datetime.fromisoformat(pr["createdAt"].replace('Z', '+00:00')).timestamp()
+
+
+def _table_row(pr: Dict, repo: Optional[str] = None) -> str:
+    author = pr.get("author") or {}
+    login = author.get("login", "unknown")
+    title = pr["title"]
+    url = pr["url"]
+    created_at = datetime.fromisoformat(pr["createdAt"].replace('Z', '+00:00')).strftime('%Y-%m-%d')
+    changes = f"+{pr.get('additions', 0)}/-{pr.get('deletions', 0)}"
+    repo_cell = f"{repo} | " if repo else ""
+    return f"| {repo_cell}[{title}]({url}) | {login} | {pr['state']} | {created_at} | {changes} |\n"
+
+
+def _search_qualifiers(repo: str, filters: Dict, sort: str) -> str:
+    search_qualifiers = f"repo:{repo} is:pr"
+
+    # Add search term filter (applied to PR title and body) if provided
+    if filters.get("search_term"):
+        search_qualifiers += f' "{filters["search_term"]}" in:title,body'
+
+    # Add created date range if provided
+    start_date, end_date = filters.get("start_date"), filters.get("end_date")
+    if start_date and end_date:
+        search_qualifiers += f" created:{start_date}..{end_date}"
+    elif start_date:
+        search_qualifiers += f" created:>={start_date}"
+    elif end_date:
+        search_qualifiers += f" created:<={end_date}"
+
+    # Add author filter if provided
+    if filters.get("author"):
+        search_qualifiers += f" author:{filters['author']}"
+
+    # Without a sort qualifier GitHub orders by best match
+    if sort == SORT_RECENT or not filters.get("search_term"):
+        search_qualifiers += " sort:created-desc"
+    return search_qualifiers
+
+
+def _live_search(repo: str, headers: Dict, filters: Dict, sort: str, limit: int) -> Generator[Dict, None, None]:
+    """
+    Design-related PRs of one repository from the live API, in search order.
+    PR headers are searched first, then the changed files of candidate PRs are checked in batched queries
+    that stop per PR at the first frontend file.
+    """
+    variables = {
+        "query": _search_qualifiers(repo, filters, sort),
+        "first": SEARCH_PAGE_SIZE,
+        "after": None,
+    }
+    logger.info(f"GraphQL search variables: {json.dumps(variables)}")
+
+    usage = {}
+    scanned = 0
+    listed = 0
+    pages = 0
+    try:
+        while listed < limit:
+            search = graphql(headers, SEARCH_QUERY, variables, usage)["search"]
+            pages += 1
+            # Non-PR results come back as empty objects
+            pr_nodes = [node for node in search["nodes"] if node]
+            scanned += len(pr_nodes)
+            logger.info(f"Search page {pages} of {repo}: {len(pr_nodes)} PRs")
+
+            # PRs without changed files can never touch the frontend
+            candidates = [pr for pr in pr_nodes if pr.get("changedFiles") != 0]
+            for start in range(0, len(candidates), FILES_BATCH_SIZE):
+                batch = candidates[start:start + FILES_BATCH_SIZE]
+                design_ids = prs_touching(headers, [pr["id"] for pr in batch], _is_frontend_file, usage)
+                logger.debug(f"{len(design_ids)} of {len(batch)} candidate PRs in {repo} have frontend changes")
+                for pr in batch:
+                    if pr["id"] in design_ids and listed < limit:
+                        listed += 1
+                        yield pr
+                if listed >= limit:
+                    break
+
+            page_info = search.get("pageInfo") or {}
+            if not page_info.get("hasNextPage"):
+                break
+            variables["after"] = page_info.get("endCursor")
+    finally:
+        logger.info(f"Scanned {scanned} PRs of {repo} in {pages} page(s), {listed} design-related")
+        logger.info(f"PR lookup of {repo} used {usage.get('cost', 0)} GraphQL points, {usage.get('remaining', 'unknown')} remaining")
+
+
+def _search_repo(repo: str, headers: Dict, filters: Dict, sort: str, limit: int) -> Generator[Dict, None, None]:
+    """
+    Design-related PRs of one repository, from the local mirror once it has been fully synced,
+    otherwise from the live API while the mirror is filled in the background.
+    """
+    if pr_mirror.is_synced(repo):
+        try:
+            # Only PRs updated since the last sync are fetched from GitHub
+            pr_mirror.sync(repo, headers)
+        except Exception as e:
+            logger.warning(f"Could not refresh the PR mirror for {repo}, answering from the last sync: {str(e)}")
+        prs = pr_mirror.search(
+            repo,
+            filters.get("start_date"),
+            filters.get("end_date"),
+            filters.get("author"),
+            filters.get("search_term"),
+            FRONTEND_EXTENSIONS,
+            limit=limit,
+            order=sort,
+        )
+        logger.info(f"PR mirror returned {len(prs)} design-related PRs for {repo}")
+        yield from prs
+        return
+
+    # Mirror the repository in the background, later lookups are answered locally
+    if pr_mirror.available():
+        submit(_sync_mirror, repo, headers)
+    yield from _live_search(repo, headers, filters, sort, limit)
+
+
 @weave.op()
-def lookup_prs(github_token: str, search_data: Dict) -> Generator[str, None, None]:
+def lookup_prs(
+    github_token: str,
+    search_data: Dict,
+    max_results: int = DEFAULT_MAX_RESULTS,
+    repositories: Optional[List[str]] = None,
+    sort: Optional[str] = None,
+) -> Generator[str, None, None]:
     """
     Look up pull requests based on search criteria and return a generator that yields status updates and results.
+    Every repository is searched concurrently, results are merged without duplicates and sorted by recency
+    ("recent") or by each repository's own ranking ("relevance", interleaved). Rows stream into the table
+    as soon as their place in the merged order is known, and the lookup stops after `max_results` PRs.
+    Concurrent identical lookups share one in-flight stream.
     """
+    repositories = list(repositories or DEFAULT_REPOSITORIES)
+    key = make_key(github_token, search_data, max_results, repositories, sort)
+    return pr_flight.stream(key, lambda: _lookup_prs(github_token, search_data, max_results, repositories, sort))
+
+
+def _lookup_prs(github_token: str, search_data: Dict, max_results: int, repositories: List[str], sort: Optional[str]) -> Generator[str, None, None]:
     try:
         # Initial status update
         yield "> Looking up pull requests...\n\n"
 
         # Extract search parameters
-        start_date = search_data.get('start_date')
-        end_date = search_data.get('end_date')
-        author = search_data.get('author')
-        search_term = search_data.get('search_term')
+        filters = {
+            "start_date": search_data.get('start_date'),
+            "end_date": search_data.get('end_date'),
+            "author": search_data.get('author'),
+            "search_term": search_data.get('search_term'),
+        }
+        sort = (search_data.get('sort') or sort or "").strip().lower()
+        if sort not in SORT_ORDERS:
+            sort = SORT_RELEVANCE if filters["search_term"] else SORT_RECENT
 
         # Log search parameters
         logger.info("Search Parameters:")
-        logger.info(f"  - Start Date: {start_date}")
-        logger.info(f"  - End Date: {end_date}")
-        logger.info(f"  - Author: {author}")
-        logger.info(f"  - Search Term: {search_term}")
+        logger.info(f"  - Start Date: {filters['start_date']}")
+        logger.info(f"  - End Date: {filters['end_date']}")
+        logger.info(f"  - Author: {filters['author']}")
+        logger.info(f"  - Search Term: {filters['search_term']}")
+        logger.info(f"  - Sort: {sort}")
 
         # --- Step 1: Setup GitHub API configuration ---
-        graphql_url = "https://api.github.com/graphql"
-        headers = {"Authorization": f"bearer {github_token}"}
-
-        # Default to searching in the current repository
-        owner = "wandb"  # This should be configurable
-        repo_name = "weave"  # This should be configurable
-        
-        logger.info(f"Target Repository: {owner}/{repo_name}")
+        headers = auth_headers(github_token)
+        logger.info(f"Target Repositories: {', '.join(repositories)}")
         yield "> Successfully configured GitHub API access\n\n"
 
-        # --- Step 2: Build search query ---
-        search_qualifiers = f"repo:{owner}/{repo_name} is:pr"
-
-        # Add search term filter (applied to PR title and body) if provided
-        if search_term:
-            search_qualifiers += f' "{search_term}" in:title,body'
-
-        # Add created date range if provided
-        if start_date and end_date:
-            search_qualifiers += f" created:{start_date}..{end_date}"
-        elif start_date:
-            search_qualifiers += f" created:>={start_date}"
-        elif end_date:
-            search_qualifiers += f" created:<={end_date}"
-
-        # Add author filter if provided
-        if author:
-            search_qualifiers += f" author:{author}"
-
-        logger.info(f"Search Query: {search_qualifiers}")
-        yield "> Built search query with provided filters\n\n"
-
-        # --- Step 3: Define and execute GraphQL query ---
-        graphql_query = """
-        query SearchPRs($query: String!) {
-          search(first: 100, query: $query, type: ISSUE) {
-            nodes {
-              ... on PullRequest {
-                title
-                url
-                state
-                createdAt
-                updatedAt
-                additions
-                deletions
-                author {
-                  ... on User {
-                    login
-                    name
-                  }
-                }
-                files(first: 100) {
-                  edges {
-                    node {
-                      path
-                    }
-                  }
-                }
-              }
-            }
-          }
-        }
-        """
-
-        variables = {"query": search_qualifiers}
-        
-        # Log request details
-        logger.info("GraphQL Request Details:")
-        logger.info(f"  URL: {graphql_url}")
-        logger.info(f"  Variables: {json.dumps(variables, indent=2)}")
-        
-        response = requests.post(graphql_url, json={"query": graphql_query, "variables": variables}, headers=headers)
-        
-        # Log response details
-        logger.info(f"Response Status: {response.status_code}")
-        
-        if response.status_code != 200:
-            error_msg = f"GraphQL query failed with status {response.status_code}: {response.text}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
-
-        data = response.json()
-        
-        # Log response data
-        logger.info("Response Data:")
-        logger.info(json.dumps(data, indent=2))
-        
-        if "errors" in data:
-            logger.error(f"GraphQL Errors: {json.dumps(data['errors'], indent=2)}")
-            raise Exception(f"GraphQL query returned errors: {data['errors']}")
-            
-        pr_nodes = data["data"]["search"]["nodes"]
-        logger.info(f"PRs Found: {len(pr_nodes)}")
-
-        # Log first few PR titles for debugging
-        if pr_nodes:
-            logger.info("First few PRs found:")
-            for pr in pr_nodes[:3]:
-                logger.info(f"  - {pr.get('title')} by {pr.get('author', {}).get('login')}")
-
-        yield f"> Found {len(pr_nodes)} pull requests\n\n"
-
-        # --- Step 4: Filter and format results ---
-        # Look for frontend-related files
-        frontend_extensions = ('.css', '.less', '.html', '.js', '.jsx', '.ts', '.tsx')
-        filtered_prs = []
-
-        for pr in pr_nodes:
-            # Check if PR has frontend file changes
-            files_edges = pr.get("files", {}).get("edges", [])
-            has_frontend_change = any(edge["node"]["path"].lower().endswith(frontend_extensions)
-                                  for edge in files_edges)
-            if has_frontend_change:
-                filtered_prs.append(pr)
-                logger.info(f"Including PR: {pr.get('title')} (has frontend changes)")
+        max_results = max(1, int(max_results or DEFAULT_MAX_RESULTS))
+        multi_repo = len(repositories) > 1
+        if multi_repo:
+            yield f"> Searching {len(repositories)} repositories\n\n"
+
+        # --- Step 2: Search every repository concurrently ---
+        failures = []
+
+        def repo_stream(repo):
+            def run():
+                try:
+                    # Each repository stream is ranked on its own, the rank orders the merge by relevance
+                    for rank, pr in enumerate(_search_repo(repo, headers, filters, sort, max_results + 1)):
+                        yield rank, repo, pr
+                except Exception as e:
+                    logger.error(f"PR lookup in {repo} failed: {str(e)}")
+                    failures.append((repo, str(e)))
+            return run
+
+        if sort == SORT_RECENT:
+            merge_key = lambda item: -_created_timestamp(item[2])
+        else:
+            merge_key = lambda item: item[0]
+
+        # --- Step 3: Stream the merged, de-duplicated rows into the markdown table ---
+        seen_urls = set()
+        listed = 0
+        truncated = False
+        for _, repo, pr in merge_sorted([repo_stream(repo) for repo in repositories], key=merge_key, max_concurrency=MAX_REPO_CONCURRENCY):
+            if pr["url"] in seen_urls:
+                continue
+            seen_urls.add(pr["url"])
+            if listed >= max_results:
+                truncated = True
+                break
+            if listed == 0:
+                if multi_repo:
+                    yield "| Repository | Title | Author | State | Created | Changes |\n|---|---|---|---|---|---|\n"
+                else:
+                    yield "| Title | Author | State | Created | Changes |\n|---|---|---|---|---|\n"
+            listed += 1
+            yield _table_row(pr, repo if multi_repo else None)
+
+        if listed:
+            yield "\n\n"
+        for repo, error in failures:
+            yield f"> Could not search {repo}: {error}\n\n"
+        if listed:
+            if truncated:
+                yield f"> Showing the first {listed} design-related pull requests, narrow the search to see more\n\n"
             else:
-                logger.info(f"Excluding PR: {pr.get('title')} (no frontend changes)")
-
-        logger.info(f"Frontend PRs Found: {len(filtered_prs)}")
-        yield f"> Filtered to {len(filtered_prs)} design-related pull requests\n\n"
-
-        # --- Step 5: Generate markdown table ---
-        if filtered_prs:
-            markdown_table = "| Title | Author | State | Created | Changes |\n"
-            markdown_table += "|---|---|---|---|---|\n"
-
-            for pr in filtered_prs:
-                author = pr.get("author") or {}
-                login = author.get("login", "unknown")
-                name = author.get("name", "unknown")
-                title = pr["title"]
-                url = pr["url"]
-                created_at = datetime.fromisoformat(pr["createdAt"].replace('Z', '+00:00')).strftime('%Y-%m-%d')
-                additions = pr.get("additions", 0)
-                deletions = pr.get("deletions", 0)
-                changes = f"+{additions}/-{deletions}"
-                state = pr["state"]
-
-                markdown_table += f"| [{title}]({url}) | {login} | {state} | {created_at} | {changes} |\n"
-
-            yield markdown_table + "\n\n"
+                yield f"> Found {listed} design-related pull requests\n\n"
             yield "Your pull requests have been successfully retrieved! Let me know if you'd like to perform another search or need any other assistance."
         else:
             yield "No matching pull requests found.\n\n"
@@ -177,4 +318,4 @@ def lookup_prs(github_token: str, search_data: Dict) -> Generator[str, None, Non
     except Exception as e:
         error_msg = f"Error during PR lookup: {str(e)}"
         logger.error(error_msg)
-        yield f"Error: {error_msg}\n\n" 
\ No newline at end of file
+        yield f"Error: {error_msg}\n\n"
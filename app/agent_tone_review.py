@@ -1,27 +1,22 @@
 import logging
-from openai import OpenAI
-from typing import Generator
+import re
+from llm_clients import get_client
+from streaming import completion_deltas, normalize_stream, stream_completion
+from context import build_messages, flight_history
+from vision_preprocess import vision_content
+from background import prefetch_stream
+from single_flight import SingleFlight, make_key
+from typing import Callable, Generator, List, Optional
 import weave
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@weave.op()
-def tone_text_copy_review(
-    image_url: str,
-    api_endpoint: str,
-    api_key: str,
-    api_model: str,
-    thread_messages: list = None,
-) -> Generator[str, None, None]:
-    logger.info("Starting tone and text copy review process...")
-    
-    try:
-        client = OpenAI(base_url=api_endpoint, api_key=api_key)
-        
-        # Step 1: Extract text content from the image
-        extraction_prompt = """
+# Number of images sent in one extraction request in batched mode
+DEFAULT_TONE_BATCH_SIZE = 4
+
+EXTRACTION_PROMPT = """
 You are an expert at extracting text content from UI designs.
 
 ## Please list all text content from the image, categorized by:
@@ -46,31 +41,7 @@ Only include text that actually appears in the image.
 - Do not nest bullet points.
 """.strip()
 
-        messages = [
-            {"role": "system", "content": extraction_prompt},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": "Please extract all text content from this design:"},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": image_url},
-                    },
-                ],
-            }
-        ]
-
-        # Get text extraction response
-        extraction_response = client.chat.completions.create(
-            model=api_model,
-            messages=messages,
-            stream=False
-        )
-        
-        extracted_text = extraction_response.choices[0].message.content
-
-        # Step 2: Review the extracted text for tone, grammar, and style
-        review_prompt = """
+REVIEW_PROMPT = """
 You are an expert content strategist and copy editor.
 
 ## Task
@@ -108,59 +79,212 @@ Be direct and specific. Skip general feedback and focus on actionable improvemen
 - Do not nest bullet points.
 """.strip()
 
+BATCH_EXTRACTION_INSTRUCTIONS = """
+## Multiple images:
+- You will receive several frames, each introduced by a "Frame [NUMBER]:" label.
+- A tall frame may be split into several overlapping images, treat them as one frame and skip text repeated in the overlap.
+- Start the text of each frame with a line of the form: ## Frame [NUMBER]
+- Cover every frame, in order, even if it contains no text.
+""".strip()
+
+FRAME_HEADER_PATTERN = re.compile(r"^\s*#+\s*Frame\s+(\d+)", re.IGNORECASE)
+
+# Identical extractions and reviews running at the same time share one model call
+extraction_flight = SingleFlight("vision.tone_extraction")
+review_flight = SingleFlight("vision.tone_review")
+
+
+def _extraction_deltas(client, api_endpoint: str, api_model: str, messages: list, image_urls: List[str], on_content: Callable[[str], None]) -> Generator[str, None, None]:
+    """Raw text deltas of the extraction request, shared with concurrent extractions of the same images."""
+    key = make_key(api_endpoint, api_model, image_urls, messages[0]["content"])
+    deltas = extraction_flight.stream(
+        key,
+        lambda: completion_deltas(client.chat.completions.create(model=api_model, messages=messages, stream=True))
+    )
+    for delta in deltas:
+        on_content(delta)
+        yield delta
+
+
+def _review_stream(client, api_model: str, extracted_text: str, thread_messages: list = None) -> Generator[str, None, None]:
+    """
+    Stream the tone, grammar and style review of already extracted text, shared with concurrent reviews
+    of the same text and thread history.
+    """
+    messages = [
+        {"role": "system", "content": REVIEW_PROMPT},
+        {"role": "user", "content": f"Below is the extracted UI text content to review. Please provide specific feedback on any issues:\n\n{extracted_text}"}
+    ]
+
+    # Add as much recent thread history as fits the budget
+    history, _ = build_messages("tone_review", api_model, thread_messages)
+    messages.extend(history)
+
+    key = make_key(client.base_url, api_model, flight_history(messages))
+    return review_flight.stream(key, lambda: _run_review(client, api_model, messages))
+
+
+def _run_review(client, api_model: str, messages: list) -> Generator[str, None, None]:
+    stream = client.chat.completions.create(
+        model=api_model,
+        messages=messages,
+        stream=True
+    )
+    yield from stream_completion(stream)
+
+
+@weave.op()
+def tone_text_copy_review(
+    image_url: str,
+    api_endpoint: str,
+    api_key: str,
+    api_model: str,
+    thread_messages: list = None,
+) -> Generator[str, None, None]:
+    logger.info("Starting tone and text copy review process...")
+    
+    try:
+        client = get_client(api_endpoint, api_key)
+        
+        # Step 1: Extract text content from the image, streamed to the user as it is produced
+        image_parts, _ = vision_content(image_url)
         messages = [
-            {"role": "system", "content": review_prompt},
-            {"role": "user", "content": f"Below is the extracted UI text content to review. Please provide specific feedback on any issues:\n\n{extracted_text}"}
+            {"role": "system", "content": EXTRACTION_PROMPT},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Please extract all text content from this design:"},
+                    *image_parts,
+                ],
+            }
         ]
 
-        # Add thread history if available
-        if thread_messages:
-            for msg in thread_messages:
-                if not msg["message"].strip():
-                    continue
-                messages.append({
-                    "role": msg["sender"].lower(),
-                    "content": msg["message"]
-                })
-
         yield "📝 Extracted text content:\n\n"
-        yield f"{extracted_text}\n\n"
-        yield "🔍 Content review:\n\n"
 
-        stream = client.chat.completions.create(
-            model=api_model,
-            messages=messages,
-            stream=True
+        extracted_parts = []
+        yield from normalize_stream(
+            _extraction_deltas(client, api_endpoint, api_model, messages, [image_url], extracted_parts.append)
         )
+        extracted_text = "".join(extracted_parts)
 
-        buffer = ""
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                content = chunk.choices[0].delta.content
-                # Add to buffer
-                buffer += content
-                
-                # If we have a newline or sufficient content, process and yield
-                if '\n' in buffer or len(buffer) > 80:
-                    # Split by newlines to preserve them
-                    parts = buffer.split('\n')
-                    
-                    # Process all parts except the last one
-                    for part in parts[:-1]:
-                        # Normalize spaces while preserving intentional newlines
-                        normalized = ' '.join(part.split())
-                        if normalized:
-                            yield normalized + '\n'
-                    
-                    # Keep the last part in buffer
-                    buffer = parts[-1]
-        
-        # Process any remaining content in buffer
-        if buffer:
-            normalized = ' '.join(buffer.split())
-            if normalized:
-                yield normalized
+        # Step 2: Review the extracted text for tone, grammar, and style
+        yield "\n\n🔍 Content review:\n\n"
+        yield from _review_stream(client, api_model, extracted_text, thread_messages)
                 
     except Exception as e:
         logger.error(f"Error in tone and text copy review: {e}")
-        yield f"Error: {e}" 
\ No newline at end of file
+        yield f"Error: {e}"
+
+
+@weave.op()
+def tone_text_copy_review_batch(
+    image_urls: List[str],
+    api_endpoint: str,
+    api_key: str,
+    api_model: str,
+    thread_messages: list = None,
+    on_review: Optional[Callable[[str, str], None]] = None,
+) -> Generator[str, None, None]:
+    """
+    Extract the text of several images in a single vision request and review each one.
+    The review of a frame starts as soon as its extracted text is complete, while later frames are still being extracted.
+    `on_review(url, review)` is called with each frame's finished review.
+    """
+    logger.info(f"Starting batched tone and text copy review for {len(image_urls)} images...")
+
+    reviews = {}
+    try:
+        client = get_client(api_endpoint, api_key)
+
+        content = [{"type": "text", "text": f"Please extract all text content from these {len(image_urls)} designs:"}]
+        for idx, url in enumerate(image_urls):
+            image_parts, _ = vision_content(url)
+            content.append({"type": "text", "text": f"Frame {idx + 1}:"})
+            content.extend(image_parts)
+
+        messages = [
+            {"role": "system", "content": EXTRACTION_PROMPT + "\n\n" + BATCH_EXTRACTION_INSTRUCTIONS},
+            {"role": "user", "content": content},
+        ]
+
+        extracted = {}
+        current = {"frame": None, "lines": [], "partial": ""}
+
+        def start_review(frame_number):
+            extracted_text = "\n".join(extracted[frame_number]).strip()
+            logger.info(f"Extraction of frame {frame_number} complete, starting its review")
+            reviews[frame_number] = prefetch_stream(
+                lambda: _review_stream(client, api_model, extracted_text, thread_messages)
+            )
+
+        def add_line(line):
+            header = FRAME_HEADER_PATTERN.match(line)
+            if header:
+                frame_number = int(header.group(1))
+                if not 1 <= frame_number <= len(image_urls):
+                    # No such frame, its review would never be read
+                    logger.warning(f"Ignoring header of frame {frame_number}, only {len(image_urls)} were sent")
+                    return
+                if frame_number == current["frame"]:
+                    # A repeated header of the frame being extracted, its text continues
+                    return
+                # A new frame header means the previous frame's text is complete
+                if current["frame"] is not None:
+                    start_review(current["frame"])
+                if frame_number in extracted:
+                    # Its review is already running, drop the second copy instead of orphaning it
+                    logger.warning(f"Frame {frame_number} extracted twice, ignoring the repeat")
+                    current["frame"] = None
+                    return
+                current["frame"] = frame_number
+                extracted[current["frame"]] = []
+            elif current["frame"] is not None:
+                extracted[current["frame"]].append(line)
+
+        lines_seen = []
+
+        def on_content(delta):
+            lines_seen.append(delta)
+            lines = (current["partial"] + delta).split("\n")
+            current["partial"] = lines.pop()
+            for line in lines:
+                add_line(line)
+
+        yield "📝 Extracted text content:\n\n"
+
+        yield from normalize_stream(
+            _extraction_deltas(client, api_endpoint, api_model, messages, image_urls, on_content)
+        )
+
+        if current["partial"]:
+            add_line(current["partial"])
+        if current["frame"] is not None:
+            start_review(current["frame"])
+        elif not extracted:
+            # The model ignored the frame headers, review everything at once
+            extracted_text = "".join(lines_seen)
+            yield "\n\n🔍 Content review:\n\n"
+            yield from _review_stream(client, api_model, extracted_text, thread_messages)
+            return
+
+        # Step 2: Stream the reviews in frame order, most of them are already underway
+        for idx, url in enumerate(image_urls):
+            frame_number = idx + 1
+            yield f"\n\n🔍 Content review for {url} ({frame_number} of {len(image_urls)}):\n\n"
+            if frame_number not in reviews:
+                yield "No text content was extracted for this frame.\n"
+                continue
+            review_parts = []
+            for chunk in reviews[frame_number].items():
+                review_parts.append(chunk)
+                yield chunk
+            if on_review:
+                on_review(url, "".join(review_parts))
+
+    except Exception as e:
+        logger.error(f"Error in batched tone and text copy review: {e}")
+        yield f"Error: {e}"
+    finally:
+        # Stop the reviews nobody will read, after an error or when the client went away
+        for review in reviews.values():
+            review.stop()
@@ -1,13 +1,28 @@
-from agent import  gen_streaming_response, gen_thread_title
-from django.db import models
-from django.http import StreamingHttpResponse
+from agent import gen_streaming_response, gen_thread_title
+from background import submit
+from django.conf import settings as django_settings
+from django.db import close_old_connections, models
+from django.db.models.functions import Length
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from ksuid import Ksuid
 from nanodjango import Django
-from openai import OpenAI
+from image_store import ALLOWED_CONTENT_TYPES, image_store
+from llm_clients import configure_clients, get_client, retire_client
+from streaming import configure_flush_policy
+from summarizer import apply_summary, messages_to_fold, update_summary
+from settings_cache import AppSettings, SENSITIVE_KEYS, SettingsCache, TTLCache
 from logger import logger
+import base64
+import copy
+import frame_changes
 import json
+import metrics
 import os
+import single_flight
+import threading
 import weave
 
 
@@ -36,7 +51,7 @@ class KSUIDField(models.CharField):
 
 
 class Settings(models.Model):
-    key = models.CharField(max_length=255)
+    key = models.CharField(max_length=255, unique=True)
     value = models.TextField()
 
 
@@ -45,8 +60,23 @@ class Thread(models.Model):
     thread_name = models.CharField(max_length=255)
     created_on = models.DateTimeField(auto_now_add=True)
     edited_on = models.DateTimeField(auto_now=True)
+    # Creation time of the newest message, or of the thread until it has one
+    last_message_at = models.DateTimeField(default=timezone.now)
     metadata = models.JSONField(default=dict, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["last_message_at", "id"], name="thread_last_message_idx"),
+            # Delta refreshes of the thread list also pick up renamed threads
+            models.Index(fields=["edited_on"], name="thread_edited_idx"),
+        ]
+
+    def refresh_last_message_at(self):
+        """Recompute last_message_at from the remaining messages, after one was deleted."""
+        latest = self.messages.aggregate(latest=models.Max("created_on"))["latest"]
+        self.last_message_at = latest or self.created_on
+        Thread.objects.filter(id=self.id).update(last_message_at=self.last_message_at)
+
 
 class Message(models.Model):
     id = KSUIDField(primary_key=True)
@@ -58,6 +88,131 @@ class Message(models.Model):
     edited_on = models.DateTimeField(auto_now=True)
     metadata = models.JSONField(default=dict, blank=True)
 
+    class Meta:
+        indexes = [
+            # Message windows and history are read per thread in (created_on, id) order
+            models.Index(fields=["thread", "created_on", "id"], name="message_thread_created_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            # Keep the thread list ordering current without aggregating over every message
+            Thread.objects.filter(id=self.thread_id).update(last_message_at=self.created_on)
+            self.thread.last_message_at = self.created_on
+
+
+### Settings
+
+
+def load_settings():
+    """Load every setting in a single query."""
+    return {setting.key: setting.value for setting in Settings.objects.all()}
+
+
+settings_cache = SettingsCache(load_settings)
+models_cache = TTLCache(ttl=300)
+
+
+def configure_llm_clients(settings: AppSettings):
+    """Apply the OpenAI connection pool and stream flush settings."""
+    configure_clients(
+        timeout=settings.api_timeout,
+        max_connections=settings.api_max_connections,
+        max_keepalive_connections=settings.api_max_keepalive,
+    )
+    configure_flush_policy(
+        max_chars=settings.stream_flush_chars,
+        max_delay_ms=settings.stream_flush_ms,
+    )
+
+
+### Threads
+
+
+DEFAULT_THREAD_PAGE_SIZE = 50
+MAX_THREAD_PAGE_SIZE = 200
+DEFAULT_MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+# Serializes read-modify-write updates of Thread.metadata from request and background threads
+_metadata_lock = threading.Lock()
+# Thread.metadata entries kept for the agents only, they can hold every cached review of a thread
+INTERNAL_METADATA_KEYS = ("summary", "summary_upto", "frame_reviews")
+
+
+def get_thread_messages(thread):
+    """Thread messages in the form the agents expect, oldest first."""
+    return [
+        {
+            "id": msg.id,
+            "sender": msg.sender,
+            "message": msg.message,
+            "type": msg.type,
+            "metadata": msg.metadata
+        }
+        for msg in thread.messages.all().order_by('created_on', 'id')
+    ]
+
+
+def update_thread_summary(thread_id: str, api_endpoint: str, api_key: str, api_model: str):
+    """
+    Fold older messages into the thread's running summary once the history passes the threshold.
+    Runs in the background after each response, the summary is extended and never rebuilt.
+    """
+    with _summarizing_lock:
+        if thread_id in _summarizing:
+            return
+        _summarizing.add(thread_id)
+
+    try:
+        thread = Thread.objects.get(id=thread_id)
+        to_fold = messages_to_fold(get_thread_messages(thread), thread.metadata, api_model)
+        if not to_fold:
+            return
+
+        summary = update_summary(
+            get_client(api_endpoint, api_key),
+            api_model,
+            thread.metadata.get("summary"),
+            to_fold
+        )
+
+        # Reload so concurrent metadata updates are not overwritten
+        with _metadata_lock:
+            thread.refresh_from_db(fields=["metadata"])
+            thread.metadata["summary"] = summary
+            thread.metadata["summary_upto"] = to_fold[-1]["id"]
+            thread.save(update_fields=["metadata"])
+        logger.info(f"Updated summary for thread {thread_id} up to message {to_fold[-1]['id']}")
+    except Exception as e:
+        logger.error(f"Failed to update thread summary: {str(e)}")
+    finally:
+        with _summarizing_lock:
+            _summarizing.discard(thread_id)
+        close_old_connections()
+
+
+def public_metadata(metadata: dict) -> dict:
+    """Thread metadata for API responses, without the server-side summary and cached frame reviews."""
+    return {key: value for key, value in (metadata or {}).items() if key not in INTERNAL_METADATA_KEYS}
+
+
+def save_frame_reviews(thread, original: dict, frame_reviews: dict):
+    """
+    Persist the per-frame review snapshots used to skip unchanged frames on the next review.
+    Only frames reviewed by this request are merged in, so concurrent reviews keep each other's entries.
+    """
+    with _metadata_lock:
+        # Reload so the summary and reviews written meanwhile are not overwritten
+        thread.refresh_from_db(fields=["metadata"])
+        stored = thread.metadata.setdefault("frame_reviews", {})
+        if frame_changes.merge_snapshots(stored, original, frame_reviews):
+            thread.save(update_fields=["metadata"])
+
 
 ### API
 
@@ -72,6 +227,13 @@ def update_openai_settings(request):
         if not all(field in data for field in required_fields):
             return {"error": "Missing required fields"}
 
+        # Reject the whole update before anything is saved
+        errors = AppSettings.validate(data)
+        if errors:
+            return {"error": "Invalid settings: " + "; ".join(f"{key} {reason}" for key, reason in errors.items())}
+
+        previous = settings_cache.get()
+
         # Update or create settings
         Settings.objects.update_or_create(
             key="api_endpoint", defaults={"value": data["api_endpoint"]}
@@ -82,25 +244,28 @@ def update_openai_settings(request):
         )
 
         # Handle optional settings
-        optional_fields = {
-            "api_model": "api_model",
-            "weave_key": "weave_key",
-            "weave_project": "weave_project",
-            "github_token": "github_token",
-            "figma_token": "figma_token"
-        }
-
-        for field_name, setting_key in optional_fields.items():
-            if field_name in data:
+        for setting_key in AppSettings.keys():
+            if setting_key in required_fields:
+                continue
+            if setting_key in data:
                 Settings.objects.update_or_create(
-                    key=setting_key, defaults={"value": data[field_name]}
+                    key=setting_key, defaults={"value": str(data[setting_key]).strip()}
                 )
-        if weave_key and weave_project:
-            weave_key = Settings.objects.get(key="weave_key").value
-            weave_project = Settings.objects.get(key="weave_project").value
-            if weave_key and weave_project:
-                os.environ["WANDB_API_KEY"] = weave_key
-                weave.init(weave_project)
+
+        # Write-through: the next read reloads the snapshot
+        settings_cache.invalidate()
+        models_cache.clear()
+        settings = settings_cache.get()
+
+        # Stop handing out clients built with the old credentials or pool limits,
+        # requests still streaming on them are left to finish
+        if (previous.api_endpoint, previous.api_key) != (settings.api_endpoint, settings.api_key):
+            retire_client(previous.api_endpoint, previous.api_key)
+        configure_llm_clients(settings)
+
+        if settings.weave_key and settings.weave_project:
+            os.environ["WANDB_API_KEY"] = settings.weave_key
+            weave.init(settings.weave_project)
 
         return {"message": "Settings updated successfully"}
     except json.JSONDecodeError:
@@ -111,21 +276,16 @@ def update_openai_settings(request):
 @app.api.get("/settings")
 def get_settings(request):
     try:
-        # Define settings to retrieve
-        setting_keys = ["api_endpoint", "api_key", "api_model", "weave_key", "weave_project", "github_token", "figma_token"]
         settings_data = {}
 
-        # Retrieve each setting
-        for key in setting_keys:
-            try:
-                setting = Settings.objects.get(key=key)
-                # Obscure sensitive information
-                if key in ["api_key", "weave_key", "github_token", "figma_token"]:
-                    settings_data[key] = "obfuscated"
-                else:
-                    settings_data[key] = setting.value
-            except Settings.DoesNotExist:
-                settings_data[key] = None
+        stored = settings_cache.values()
+        for key in AppSettings.keys():
+            value = stored.get(key)
+            # Obscure sensitive information
+            if value is not None and key in SENSITIVE_KEYS:
+                settings_data[key] = "obfuscated"
+            else:
+                settings_data[key] = value
 
         return settings_data
 
@@ -134,20 +294,24 @@ def get_settings(request):
 
 @app.api.get("/settings/openai/models")
 def get_openai_models(request):
-    try:
-        # Get settings
-        api_endpoint = Settings.objects.get(key="api_endpoint").value
-        api_key = Settings.objects.get(key="api_key").value
-    except Settings.DoesNotExist:
+    settings = settings_cache.get()
+    if not (settings.api_endpoint and settings.api_key):
         return {"error": "OpenAI API endpoint and key must be configured first"}
 
+    cache_key = (settings.api_endpoint, settings.api_key)
+    cached_models = models_cache.get(cache_key)
+    if cached_models is not None:
+        return {"models": cached_models}
+
     try:
-        # Initialize OpenAI client
-        client = OpenAI(base_url=api_endpoint, api_key=api_key)
+        # Reuse the pooled OpenAI client
+        configure_llm_clients(settings)
+        client = get_client(settings.api_endpoint, settings.api_key)
 
         # Fetch models
-        models = client.models.list()
-        return {"models": [model.id for model in models]}
+        model_ids = [model.id for model in client.models.list()]
+        models_cache.set(cache_key, model_ids)
+        return {"models": model_ids}
 
     except Exception as e:
         return {"error": f"Failed to fetch models from OpenAI API: {str(e)}"}
@@ -170,6 +334,7 @@ def create_thread(request):
                 "id": thread.id,
                 "thread_name": thread.thread_name,
                 "created_on": thread.created_on,
+                "latest_message": thread.last_message_at,
             },
         }
 
@@ -177,57 +342,179 @@ def create_thread(request):
         return {"error": f"Failed to create thread: {str(e)}"}
 
 
+def _parse_timestamp(value: str):
+    """ISO 8601 timestamp from a query parameter, matching the project's USE_TZ setting."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Invalid timestamp: {value}")
+    if django_settings.USE_TZ and timezone.is_naive(parsed):
+        return timezone.make_aware(parsed)
+    if not django_settings.USE_TZ and timezone.is_aware(parsed):
+        return timezone.make_naive(parsed)
+    return parsed
+
+
+def encode_thread_cursor(thread) -> str:
+    """Opaque keyset cursor pointing just past a thread in the list order."""
+    raw = f"{thread.last_message_at.isoformat()}|{thread.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_thread_cursor(cursor: str):
+    try:
+        timestamp, thread_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+    except (ValueError, UnicodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return _parse_timestamp(timestamp), thread_id
+
+
 @app.api.get("/threads")
-def list_threads(request):
+def list_threads(request, limit: int = DEFAULT_THREAD_PAGE_SIZE, before: str = None, since: str = None):
+    """
+    Threads by latest activity, newest first, one page at a time. Pass the returned `next_cursor`
+    as `before` for the next page. With `since` (the `synced_at` of an earlier response) only threads
+    with new messages or changes after that time are returned, unpaginated.
+    """
     try:
-        threads = (
-            Thread.objects.annotate(
-                latest_message_date=models.Max('messages__created_on')
+        # Taken before querying, so changes made while this request runs show up in the next delta
+        synced_at = timezone.now()
+
+        if since:
+            changed_after = _parse_timestamp(since)
+            # Sorted here rather than in SQL, so both sides of the OR are answered from their indexes
+            page = sorted(
+                Thread.objects.filter(
+                    models.Q(last_message_at__gt=changed_after) | models.Q(edited_on__gt=changed_after)
+                ),
+                key=lambda thread: (thread.last_message_at, thread.id),
+                reverse=True,
             )
-            .order_by('-latest_message_date', '-created_on')
-        )
+            next_cursor = None
+        else:
+            limit = max(1, min(limit, MAX_THREAD_PAGE_SIZE))
+            threads = Thread.objects.order_by("-last_message_at", "-id")
+            if before:
+                last_message_at, thread_id = decode_thread_cursor(before)
+                # The redundant bound lets SQLite seek the index instead of scanning it
+                threads = threads.filter(
+                    models.Q(last_message_at__lt=last_message_at) | models.Q(id__lt=thread_id),
+                    last_message_at__lte=last_message_at,
+                )
+            # One extra row tells whether another page follows
+            page = list(threads[:limit + 1])
+            next_cursor = encode_thread_cursor(page[limit - 1]) if len(page) > limit else None
+            page = page[:limit]
+
         thread_list = []
 
-        for thread in threads:
+        for thread in page:
             thread_data = {
                 "id": thread.id,
                 "thread_name": thread.thread_name,
                 "created_on": thread.created_on,
-                "latest_message": thread.latest_message_date,
-                "metadata": thread.metadata,
+                "latest_message": thread.last_message_at,
+                "metadata": public_metadata(thread.metadata),
             }
             thread_list.append(thread_data)
 
-        return {"threads": thread_list}
+        return {"threads": thread_list, "next_cursor": next_cursor, "synced_at": synced_at}
 
     except Exception as e:
         return {"error": f"Failed to list threads: {str(e)}"}
 
 
+def _message_position(thread, message_id: str):
+    """(created_on, id) of a message of the thread, the keyset position a cursor stands for."""
+    anchor = thread.messages.filter(id=message_id).values("created_on").first()
+    if anchor is None:
+        raise ValueError(f"Message not found in thread: {message_id}")
+    return anchor["created_on"], message_id
+
+
 @app.api.get("/thread/{thread_id}")
-def get_thread(request, thread_id: str):
+def get_thread(
+    request,
+    thread_id: str,
+    limit: int = DEFAULT_MESSAGE_PAGE_SIZE,
+    before: str = None,
+    after: str = None,
+    max_body_chars: int = None,
+):
+    """
+    A thread with one window of its messages, oldest first. Without a cursor the latest `limit`
+    messages are returned, `before` / `after` (message ids) page towards older or newer messages.
+    Messages are ordered by (created_on, id): KSUIDs only sort to the second, so the id breaks ties.
+    With `max_body_chars`, longer bodies are left out and flagged `omitted`, fetch them from
+    /message/{id} when needed.
+    """
     try:
         try:
             thread = Thread.objects.get(id=thread_id)
         except Thread.DoesNotExist:
             return {"error": "Thread not found"}
-        
+
+        if before and after:
+            return {"error": "Pass either 'before' or 'after', not both"}
+        limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+
+        messages = thread.messages.all()
+        if max_body_chars is not None:
+            # Long bodies never leave the database, only their length does
+            messages = messages.defer("message").annotate(body_length=Length("message")).annotate(
+                body=models.Case(
+                    models.When(body_length__gt=max_body_chars, then=models.Value("")),
+                    default=models.F("message"),
+                    output_field=models.TextField(),
+                )
+            )
+
+        has_older = has_newer = False
+        if after:
+            created_on, message_id = _message_position(thread, after)
+            window = list(
+                messages.filter(
+                    models.Q(created_on__gt=created_on) | models.Q(id__gt=message_id), created_on__gte=created_on
+                )
+                .order_by("created_on", "id")[:limit + 1]
+            )
+            has_older = True
+            has_newer = len(window) > limit
+            window = window[:limit]
+        else:
+            if before:
+                created_on, message_id = _message_position(thread, before)
+                messages = messages.filter(
+                    models.Q(created_on__lt=created_on) | models.Q(id__lt=message_id), created_on__lte=created_on
+                )
+                has_newer = True
+            # Newest first so the window ends at the cursor, then flipped back to reading order
+            window = list(messages.order_by("-created_on", "-id")[:limit + 1])
+            has_older = len(window) > limit
+            window = window[:limit][::-1]
+
+        message_list = []
+        for message in window:
+            message_data = {
+                "id": message.id,
+                "sender": message.sender,
+                "type": message.type,
+                "created_on": message.created_on,
+            }
+            if max_body_chars is not None and message.body_length > max_body_chars:
+                message_data.update(message=None, omitted=True, length=message.body_length)
+            else:
+                message_data["message"] = message.body if max_body_chars is not None else message.message
+            message_list.append(message_data)
+
         thread_data = {
             "id": thread.id,
             "thread_name": thread.thread_name,
             "created_on": thread.created_on,
             "edited_on": thread.edited_on,
-            "metadata": thread.metadata,
-            "messages": [
-                {
-                    "id": message.id,
-                    "sender": message.sender,
-                    "type": message.type,
-                    "message": message.message,
-                    "created_on": message.created_on,
-                }
-                for message in thread.messages.all()
-            ],
+            "metadata": public_metadata(thread.metadata),
+            "messages": message_list,
+            "has_older": has_older,
+            "has_newer": has_newer,
         }
 
         return thread_data
@@ -246,20 +533,30 @@ def update_thread(request, thread_id: str):
         except Thread.DoesNotExist:
             return {"error": "Thread not found"}
 
+        # last_message_at is maintained by message writes and left alone here
+        update_fields = ["edited_on"]
         if "thread_name" in data:
             thread.thread_name = data["thread_name"]
+            update_fields.append("thread_name")
 
         if "metadata" in data:
-            thread.metadata.update(data["metadata"])
-
-        thread.save()
+            if not isinstance(data["metadata"], dict):
+                return {"error": "metadata must be an object"}
+            with _metadata_lock:
+                # Reload so the summary and reviews written meanwhile are not overwritten
+                thread.refresh_from_db(fields=["metadata"])
+                # The summary and frame reviews are written by the server only
+                thread.metadata.update(public_metadata(data["metadata"]))
+                thread.save(update_fields=update_fields + ["metadata"])
+        else:
+            thread.save(update_fields=update_fields)
 
         return {
             "message": "Thread updated successfully",
             "thread": {
                 "id": thread.id,
                 "thread_name": thread.thread_name,
-                "metadata": thread.metadata,
+                "metadata": public_metadata(thread.metadata),
             },
         }
 
@@ -334,30 +631,17 @@ def send_message(request):
             logger.error("Missing required fields in request")
             return {"error": "Missing required fields: 'thread_id', 'sender', 'type', or 'message'."}
 
-        # Get OpenAI settings
-        try:
-            api_endpoint = Settings.objects.get(key="api_endpoint").value
-            api_key = Settings.objects.get(key="api_key").value
-            api_model = Settings.objects.get(key="api_model").value
-            logger.debug("Retrieved OpenAI settings")
-        except Settings.DoesNotExist:
+        # Get settings from the in-memory snapshot
+        settings = settings_cache.get()
+        if not (settings.api_endpoint and settings.api_key and settings.api_model):
             logger.error("OpenAI settings not configured")
             return {"error": "OpenAI settings not configured"}
+        configure_llm_clients(settings)
 
-        # Get optional tokens
-        try:
-            figma_token = Settings.objects.get(key="figma_token").value
-            logger.debug("Retrieved Figma token")
-        except Settings.DoesNotExist:
-            logger.debug("No Figma token configured")
-            figma_token = None
-
-        try:
-            github_token = Settings.objects.get(key="github_token").value
-            logger.debug("Retrieved GitHub token")
-        except Settings.DoesNotExist:
-            logger.debug("No GitHub token configured")
-            github_token = None
+        api_endpoint = settings.api_endpoint
+        api_key = settings.api_key
+        api_model = settings.api_model
+        logger.debug(f"Figma token configured: {bool(settings.figma_token)}, GitHub token configured: {bool(settings.github_token)}")
 
         # Get thread
         try:
@@ -367,18 +651,17 @@ def send_message(request):
             logger.error(f"Thread not found: {data['thread_id']}")
             return {"error": "Thread not found"}
 
-        # Generate title if thread is empty
+        # Generate title if thread is empty, concurrently with the response
+        title_future = None
         if thread.messages.count() == 0:
-            logger.info("Generating title for new thread")
-            title = gen_thread_title(
+            logger.info("Generating title for new thread in the background")
+            title_future = submit(
+                gen_thread_title,
                 api_endpoint=api_endpoint,
                 api_key=api_key,
                 api_model=api_model,
                 message=data["message"]
             )
-            thread.thread_name = title
-            thread.save()
-            logger.debug(f"Set thread title: {title}")
 
         # Create user message
         user_message = Message.objects.create(
@@ -400,30 +683,39 @@ def send_message(request):
         )
         logger.info(f"Created assistant message placeholder: {assistant_message.id}")
 
-        # Get thread messages for context
-        thread_messages = [
-            {
-                "sender": msg.sender,
-                "message": msg.message,
-                "type": msg.type
-            }
-            for msg in thread.messages.all().order_by('created_on')
-        ]
+        # Get thread messages for context, older messages are replaced by the running summary
+        thread_messages = apply_summary(get_thread_messages(thread), thread.metadata)
         logger.debug(f"Retrieved {len(thread_messages)} messages for context")
 
+        def save_thread_title():
+            # Wait for the background title before the stream closes,
+            # so the client's post-stream thread refresh picks it up
+            if title_future is None:
+                return
+            try:
+                title = title_future.result(timeout=30)
+                thread.thread_name = title
+                thread.save(update_fields=["thread_name", "edited_on"])
+                logger.debug(f"Set thread title: {title}")
+            except Exception as e:
+                logger.error(f"Failed to generate thread title: {str(e)}")
+
+        # Snapshots of previously reviewed frames, updated in place by the review agents
+        original_frame_reviews = thread.metadata.get("frame_reviews", {})
+        frame_reviews = copy.deepcopy(original_frame_reviews)
+
         def generate_response():
             accumulated_message = ""
+            route_info = {}
             try:
                 # Generate streaming response
                 logger.info("Starting streaming response generation")
                 for content in gen_streaming_response(
-                    api_endpoint=api_endpoint,
-                    api_key=api_key,
-                    api_model=api_model,
+                    settings=settings,
                     message=data["message"],
                     thread_messages=thread_messages,
-                    figma_token=figma_token,
-                    github_token=github_token
+                    route_info=route_info,
+                    frame_reviews=frame_reviews
                 ):
                     accumulated_message += content
                     yield content.encode('utf-8')
@@ -431,8 +723,14 @@ def send_message(request):
                 logger.info(f"Finished streaming. Final message length: {len(accumulated_message)}")
                 # Update the assistant message with complete response
                 assistant_message.message = accumulated_message
+                # Record which routing path was taken
+                assistant_message.metadata["route"] = route_info
                 assistant_message.save()
                 logger.info("Saved assistant message")
+                if frame_reviews != original_frame_reviews:
+                    save_frame_reviews(thread, original_frame_reviews, frame_reviews)
+                save_thread_title()
+                submit(update_thread_summary, thread.id, api_endpoint, api_key, api_model)
 
             except Exception as e:
                 error_message = f"\nError occurred: {str(e)}"
@@ -441,6 +739,7 @@ def send_message(request):
                 assistant_message.message = f"Error: {str(e)}"
                 assistant_message.metadata["error"] = str(e)
                 assistant_message.save()
+                save_thread_title()
                 yield error_message.encode('utf-8')
 
         logger.info("Returning streaming response")
@@ -453,6 +752,30 @@ def send_message(request):
         logger.error(f"Failed to process message: {str(e)}")
         return {"error": f"Failed to process message: {str(e)}"}
 
+@app.api.get("/message/{message_id}")
+def get_message(request, message_id: str):
+    try:
+        try:
+            message = Message.objects.get(id=message_id)
+        except Message.DoesNotExist:
+            return {"error": "Message not found"}
+
+        return {
+            "message_data": {
+                "id": message.id,
+                "sender": message.sender,
+                "type": message.type,
+                "message": message.message,
+                "created_on": message.created_on,
+                "edited_on": message.edited_on,
+                "metadata": message.metadata,
+            },
+        }
+
+    except Exception as e:
+        return {"error": f"Failed to get message: {str(e)}"}
+
+
 @app.api.put("/message/{message_id}")
 def update_message(request, message_id: str):
     try:
@@ -501,13 +824,37 @@ def delete_message(request, message_id: str):
         except Message.DoesNotExist:
             return {"error": "Message not found"}
 
+        thread = message.thread
         message.delete()
+        thread.refresh_last_message_at()
         return {"message": "Message deleted successfully"}
 
     except Exception as e:
         return {"error": f"Failed to delete message: {str(e)}"}
     
 
+@app.api.get("/image/{digest}")
+def get_image(request, digest: str):
+    try:
+        data, content_type = image_store.read(digest)
+    except (KeyError, OSError):
+        return HttpResponse(status=404)
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        # Never serve anything but raster images from the app's origin
+        return HttpResponse(status=404)
+
+    response = HttpResponse(data, content_type=content_type)
+    response["X-Content-Type-Options"] = "nosniff"
+    # Content-addressed, the bytes behind a digest never change
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+@app.api.get("/metrics")
+def get_metrics(request):
+    return {**metrics.snapshot(), "single_flight": single_flight.snapshot()}
+
+
 ### Routes
 
 
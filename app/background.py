@@ -0,0 +1,155 @@
+import heapq
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Generator, Iterable, List
+from logger import logger
+
+# Shared pool for work that should not block the response stream
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="background")
+
+# Review prefetches get their own bounded pool, so a large batch cannot take the workers
+# that titles, summaries and speculation need
+PREFETCH_WORKERS = 4
+_prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+# Marks the end of a stream in a QueuedStream's queue
+_STREAM_DONE = object()
+
+
+def submit(fn, *args, **kwargs):
+    """Run `fn` on the shared background pool and return its Future."""
+    logger.debug(f"Submitting background task: {getattr(fn, '__name__', fn)}")
+    return _executor.submit(fn, *args, **kwargs)
+
+
+class QueuedStream:
+    """
+    A stream consumed on a worker thread into a queue and read back from another thread.
+    Submit run() to a pool, iterate items() to read, stop() asks the worker to stop early.
+    An exception raised by the stream is re-raised to the reader.
+    """
+
+    def __init__(self, factory: Callable[[], Iterable[Any]]):
+        self._factory = factory
+        self._output = queue.Queue()
+        self._stop = threading.Event()
+
+    def run(self):
+        items = None
+        try:
+            if self._stop.is_set():
+                # Stopped while waiting for a worker, never start it
+                return
+            items = iter(self._factory())
+            for item in items:
+                if self._stop.is_set():
+                    break
+                self._output.put(item)
+        except Exception as e:
+            self._output.put(e)
+        finally:
+            # Close a generator stopped early right away, so its cleanup (e.g. aborting a request) runs now
+            if hasattr(items, "close"):
+                items.close()
+            self._output.put(_STREAM_DONE)
+
+    def stop(self):
+        self._stop.set()
+
+    def items(self) -> Generator[Any, None, None]:
+        """Yield the stream's items as they arrive, the worker is stopped once the reader leaves."""
+        try:
+            while True:
+                item = self._output.get()
+                if item is _STREAM_DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.stop()
+
+
+def _start_all(stream_factories, max_concurrency: int, thread_name_prefix: str):
+    """Queued streams for the factories, running on a dedicated pool of up to `max_concurrency` workers."""
+    streams = [QueuedStream(factory) for factory in stream_factories]
+    workers = max(1, min(max_concurrency, len(streams)))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=thread_name_prefix)
+    for stream in streams:
+        executor.submit(stream.run)
+    return streams, executor
+
+
+def _stop_all(streams: List[QueuedStream], executor: ThreadPoolExecutor):
+    for stream in streams:
+        stream.stop()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def stream_ordered(
+    stream_factories: List[Callable[[], Iterable[str]]],
+    max_concurrency: int = 4,
+) -> Generator[str, None, None]:
+    """
+    Run several streams concurrently and yield their output in list order.
+    The first unfinished stream is passed through live, later ones are buffered until it completes.
+    """
+    if not stream_factories:
+        return
+
+    # A dedicated pool per fan-out, so nested submissions can never starve the shared pool
+    streams, executor = _start_all(stream_factories, max_concurrency, "fanout")
+    try:
+        for stream in streams:
+            yield from stream.items()
+    finally:
+        # Stop the remaining streams if the client went away
+        _stop_all(streams, executor)
+
+
+def merge_sorted(
+    stream_factories: List[Callable[[], Iterable[Any]]],
+    key: Callable[[Any], Any],
+    max_concurrency: int = 4,
+) -> Generator[Any, None, None]:
+    """
+    Run several streams that are each sorted by `key` concurrently and yield their items merged in `key` order.
+    An item is yielded as soon as every unfinished stream has produced something to compare it with.
+    """
+    if not stream_factories:
+        return
+
+    streams, executor = _start_all(stream_factories, max_concurrency, "merge")
+    try:
+        readers = [stream.items() for stream in streams]
+        heads = []
+        waiting = set(range(len(readers)))
+        sequence = 0
+        while waiting or heads:
+            # Every unfinished stream needs a head before the smallest one can be released
+            for idx in sorted(waiting):
+                item = next(readers[idx], _STREAM_DONE)
+                waiting.discard(idx)
+                if item is _STREAM_DONE:
+                    continue
+                heapq.heappush(heads, (key(item), sequence, idx, item))
+                sequence += 1
+            if heads:
+                _, _, idx, item = heapq.heappop(heads)
+                waiting.add(idx)
+                yield item
+    finally:
+        _stop_all(streams, executor)
+
+
+def prefetch_stream(factory: Callable[[], Iterable[str]]) -> QueuedStream:
+    """
+    Start consuming a stream on the prefetch pool and return it, read it with items().
+    Chunks produced before the caller starts reading are buffered. Prefetches beyond PREFETCH_WORKERS
+    wait for a free worker in submission order. The caller must stop() a prefetch it never reads,
+    one that has not started yet is then skipped.
+    """
+    stream = QueuedStream(factory)
+    _prefetch_executor.submit(stream.run)
+    return stream
@@ -0,0 +1,115 @@
+"""
+Print SQLite's plan for each query behind the API and fail when one scans a whole table
+or sorts in a temporary B-tree instead of reading an index in order.
+
+Run from the app directory after changing models or queries:
+
+    python check_query_plans.py
+"""
+import sys
+from datetime import timedelta
+from django.core.management import call_command
+from django.db import connection, models
+from django.utils import timezone
+from app import Message, Settings, Thread
+
+THREAD_ID = "0" * 27
+MESSAGE_ID = "z" * 27
+
+
+def api_queries():
+    """(description, queryset, index the plan must use) for the queries the endpoints run."""
+    now = timezone.now()
+    messages = Message.objects.filter(thread_id=THREAD_ID)
+    return [
+        ("settings by key", Settings.objects.filter(key="api_key"), "sqlite_autoindex_app_settings"),
+        ("thread by id", Thread.objects.filter(id=THREAD_ID), "sqlite_autoindex_app_thread"),
+        (
+            "thread list, first page",
+            Thread.objects.order_by("-last_message_at", "-id")[:51],
+            "thread_last_message_idx",
+        ),
+        (
+            "thread list, before cursor",
+            Thread.objects.order_by("-last_message_at", "-id").filter(
+                models.Q(last_message_at__lt=now) | models.Q(id__lt=THREAD_ID), last_message_at__lte=now
+            )[:51],
+            "thread_last_message_idx",
+        ),
+        (
+            "thread list, changes since",
+            Thread.objects.filter(
+                models.Q(last_message_at__gt=now - timedelta(minutes=5))
+                | models.Q(edited_on__gt=now - timedelta(minutes=5))
+            ),
+            "thread_edited_idx",
+        ),
+        (
+            "message window, latest",
+            messages.order_by("-created_on", "-id")[:51],
+            "message_thread_created_idx",
+        ),
+        (
+            "message window, before cursor",
+            messages.filter(
+                models.Q(created_on__lt=now) | models.Q(id__lt=MESSAGE_ID), created_on__lte=now
+            ).order_by("-created_on", "-id")[:51],
+            "message_thread_created_idx",
+        ),
+        (
+            "message window, after cursor",
+            messages.filter(
+                models.Q(created_on__gt=now) | models.Q(id__gt=MESSAGE_ID), created_on__gte=now
+            ).order_by("created_on", "id")[:51],
+            "message_thread_created_idx",
+        ),
+        ("message history", messages.order_by("created_on", "id"), "message_thread_created_idx"),
+        (
+            "latest message of a thread",
+            messages.values("thread_id").annotate(latest=models.Max("created_on")),
+            "message_thread_created_idx",
+        ),
+        ("message by id", Message.objects.filter(id=MESSAGE_ID), "sqlite_autoindex_app_message"),
+    ]
+
+
+def explain(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def problems(plan, index):
+    found = []
+    for step in plan:
+        # "SCAN app_thread" reads every row, "SCAN app_thread USING INDEX ..." walks an index in order
+        if step.startswith("SCAN") and "USING" not in step:
+            found.append(f"full table scan: {step}")
+        if "TEMP B-TREE" in step:
+            found.append(f"unindexed sort: {step}")
+    if not any(index in step for step in plan):
+        found.append(f"{index} not used")
+    return found
+
+
+def main() -> int:
+    call_command("migrate", verbosity=0)
+
+    failures = 0
+    for description, queryset, index in api_queries():
+        plan = explain(queryset)
+        found = problems(plan, index)
+        failures += bool(found)
+        print(f"{'FAIL' if found else 'ok  '} {description}")
+        for step in plan:
+            print(f"       {step}")
+        for problem in found:
+            print(f"    -> {problem}")
+
+    print(f"\n{failures} of {len(api_queries())} queries without a suitable index")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import tiktoken
+from logger import logger
+import metrics
+
+# Token budget for the thread history sent by each stage, system prompt included
+STAGE_BUDGETS = {
+    "router": 4000,
+    "conversation": 12000,
+    "design_review": 6000,
+    "tone_review": 4000,
+    "more_info": 6000,
+}
+DEFAULT_BUDGET = 8000
+
+# Approximate per-message overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+FALLBACK_ENCODING = "cl100k_base"
+TOKEN_CACHE_SIZE = 10000
+
+_lock = threading.Lock()
+_encodings = {}
+_token_counts = OrderedDict()
+
+
+def _load_encoding(name: str, load):
+    """Load an encoding once, caching None when tiktoken cannot provide it so it is not retried."""
+    if name in _encodings:
+        return _encodings[name]
+
+    try:
+        encoding = load()
+    except Exception as e:
+        # Encodings are downloaded on first use, estimate from length if that is not possible
+        logger.warning(f"Could not load tiktoken encoding {name}: {str(e)}")
+        encoding = None
+
+    with _lock:
+        _encodings[name] = encoding
+    return encoding
+
+
+def _encoding(api_model: str):
+    """tiktoken encoding for a model, falling back to cl100k_base for unknown or self-hosted models."""
+    if api_model in _encodings:
+        return _encodings[api_model]
+
+    try:
+        encoding = tiktoken.encoding_for_model(api_model)
+    except KeyError:
+        encoding = _load_encoding(FALLBACK_ENCODING, lambda: tiktoken.get_encoding(FALLBACK_ENCODING))
+    except Exception as e:
+        logger.warning(f"Could not load tiktoken encoding for {api_model}: {str(e)}")
+        encoding = None
+
+    with _lock:
+        _encodings[api_model] = encoding
+    return encoding
+
+
+def count_text_tokens(text: str, api_model: str) -> int:
+    encoding = _encoding(api_model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(msg: Dict, api_model: str) -> int:
+    """Token count of a thread message, cached per message id."""
+    text = msg["message"]
+    cache_key = (msg.get("id"), api_model, len(text)) if msg.get("id") else None
+
+    if cache_key:
+        with _lock:
+            if cache_key in _token_counts:
+                _token_counts.move_to_end(cache_key)
+                return _token_counts[cache_key]
+
+    tokens = count_text_tokens(text, api_model) + MESSAGE_OVERHEAD_TOKENS
+
+    if cache_key:
+        with _lock:
+            _token_counts[cache_key] = tokens
+            while len(_token_counts) > TOKEN_CACHE_SIZE:
+                _token_counts.popitem(last=False)
+    return tokens
+
+
+def build_messages(
+    stage: str,
+    api_model: str,
+    thread_messages: list = None,
+    system_prompt: Optional[str] = None,
+    budget: Optional[int] = None,
+) -> Tuple[List[Dict], Dict]:
+    """
+    Fit thread history into the stage's token budget, keeping the newest messages.
+    The system prompt and pinned messages (the running thread summary) are always kept.
+    Returns the chat messages and a report of what was dropped.
+    """
+    budget = budget or STAGE_BUDGETS.get(stage, DEFAULT_BUDGET)
+
+    used = 0
+    messages = []
+    if system_prompt:
+        used += count_text_tokens(system_prompt, api_model) + MESSAGE_OVERHEAD_TOKENS
+        messages.append({"role": "system", "content": system_prompt})
+
+    history = [msg for msg in (thread_messages or []) if msg["message"].strip()]
+    pinned = [msg for msg in history if msg.get("pinned")]
+    history = [msg for msg in history if not msg.get("pinned")]
+    for msg in pinned:
+        used += count_message_tokens(msg, api_model)
+    kept = []
+    dropped_messages = 0
+    dropped_tokens = 0
+
+    # Walk newest first, once the budget is exhausted every older message is dropped too
+    for msg in reversed(history):
+        tokens = count_message_tokens(msg, api_model)
+        if dropped_messages == 0 and used + tokens <= budget:
+            kept.append(msg)
+            used += tokens
+        else:
+            dropped_messages += 1
+            dropped_tokens += tokens
+
+    for msg in pinned + list(reversed(kept)):
+        messages.append({
+            "role": msg["sender"].lower(),
+            "content": msg["message"]
+        })
+
+    report = {
+        "stage": stage,
+        "budget": budget,
+        "used_tokens": used,
+        "kept_messages": len(pinned) + len(kept),
+        "dropped_messages": dropped_messages,
+        "dropped_tokens": dropped_tokens,
+    }
+    if dropped_messages:
+        logger.info(f"Context for {stage}: dropped {dropped_messages} message(s), {dropped_tokens} tokens over the {budget} token budget")
+        metrics.increment("context.dropped_messages", dropped_messages)
+        metrics.increment("context.dropped_tokens", dropped_tokens)
+    logger.debug(f"Context report: {report}")
+    return messages, report
+
+
+def flight_history(messages: List[Dict]) -> List[Dict]:
+    """
+    Chat messages to key a shared call on, without a repeated final user turn.
+    A double submit stores the same message twice, so both submits still share one call.
+    """
+    messages = list(messages)
+    while len(messages) >= 2 and messages[-1]["role"] == "user" and messages[-1] == messages[-2]:
+        messages.pop()
+    return messages
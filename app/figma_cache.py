@@ -0,0 +1,143 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from figma_index import FigmaIndex
+from logger import logger
+from single_flight import SingleFlight, make_key
+import upstream
+
+FIGMA_API_URL = "https://api.figma.com/v1"
+# Path of a Figma file link, both the current design/ and the older file/ form, capturing the file id
+FIGMA_FILE_PATH = r"(?:design|file)/([a-zA-Z0-9]+)"
+CACHE_DIR = os.path.join("cache", "figma")
+MEMORY_CACHE_SIZE = 16
+# How long a file's version is trusted before it is checked again
+VERSION_TTL_SECONDS = 30
+REQUEST_TIMEOUT = 60
+
+
+class FigmaDocumentCache:
+    """
+    Figma file documents cached by file id, file version and scope.
+
+    The scope is either a node id, fetched with `?ids=` so only that node, its subtree and its
+    ancestors are downloaded, or "root" for the pages and their top-level frames (`?depth=2`).
+    Documents live in an in-memory LRU and on disk, older versions of a file are removed from disk.
+    Each document in memory carries its FigmaIndex, built once per cached version.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, memory_size: int = MEMORY_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.memory_size = memory_size
+        self._lock = threading.Lock()
+        self._documents = OrderedDict()
+        self._versions = {}
+        # Concurrent requests for the same file and scope share one download
+        self._flight = SingleFlight("figma.files")
+
+    def _get(self, url: str, headers: Dict, params: Dict) -> Dict:
+        return self._flight.do(make_key(url, params, headers), self._request, url, headers, params)
+
+    def _request(self, url: str, headers: Dict, params: Dict) -> Dict:
+        response = upstream.get("figma", url, headers=headers, params=params, timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            raise Exception(f"Error fetching Figma file: {response.text}")
+        return response.json()
+
+    def file_version(self, file_id: str, headers: Dict) -> str:
+        """Current version of a file, from a depth-limited request that skips the document body."""
+        with self._lock:
+            cached = self._versions.get(file_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        data = self._get(f"{FIGMA_API_URL}/files/{file_id}", headers, {"depth": 1})
+        version = str(data.get("version") or data.get("lastModified"))
+        with self._lock:
+            self._versions[file_id] = (time.monotonic() + VERSION_TTL_SECONDS, version)
+        return version
+
+    def _path(self, file_id: str, version: str, scope: str) -> str:
+        safe_scope = re.sub(r"[^\w-]", "-", scope)
+        safe_version = re.sub(r"[^\w-]", "-", version)
+        return os.path.join(self.cache_dir, file_id, safe_version, f"{safe_scope}.json")
+
+    def _remember(self, key: Tuple, document: Dict) -> FigmaIndex:
+        index = FigmaIndex(document)
+        with self._lock:
+            self._documents[key] = index
+            self._documents.move_to_end(key)
+            while len(self._documents) > self.memory_size:
+                self._documents.popitem(last=False)
+        return index
+
+    def _load_from_disk(self, key: Tuple) -> Optional[Dict]:
+        path = self._path(*key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable Figma cache file {path}: {str(e)}")
+            return None
+
+    def _save_to_disk(self, key: Tuple, document: Dict):
+        file_id, version, _ = key
+        path = self._path(*key)
+        try:
+            # Superseded versions of the file are never read again
+            file_dir = os.path.join(self.cache_dir, file_id)
+            if os.path.isdir(file_dir):
+                current = os.path.basename(os.path.dirname(path))
+                for entry in os.listdir(file_dir):
+                    if entry != current:
+                        shutil.rmtree(os.path.join(file_dir, entry), ignore_errors=True)
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(document, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write Figma cache file {path}: {str(e)}")
+
+    def get_document(self, file_id: str, node_id: Optional[str], headers: Dict) -> Tuple[FigmaIndex, bool]:
+        """
+        Return the indexed file JSON for a node (or the file's top levels when node_id is None)
+        and whether it was served from the cache.
+        """
+        scope = node_id or "root"
+        version = self.file_version(file_id, headers)
+        key = (file_id, version, scope)
+
+        with self._lock:
+            index = self._documents.get(key)
+            if index is not None:
+                self._documents.move_to_end(key)
+        if index is not None:
+            return index, True
+
+        document = self._load_from_disk(key)
+        if document is not None:
+            return self._remember(key, document), True
+
+        params = {"ids": node_id} if node_id else {"depth": 2}
+        logger.info(f"Fetching Figma file {file_id} ({scope}) at version {version}")
+        document = self._get(f"{FIGMA_API_URL}/files/{file_id}", headers, params)
+
+        # Store under the version actually returned, in case the file changed in between
+        key = (file_id, str(document.get("version") or version), scope)
+        with self._lock:
+            self._versions[file_id] = (time.monotonic() + VERSION_TTL_SECONDS, key[1])
+        index = self._remember(key, document)
+        self._save_to_disk(key, document)
+        return index, False
+
+
+document_cache = FigmaDocumentCache()
@@ -0,0 +1,82 @@
+from typing import Dict, List, Optional
+
+
+class FigmaIndex:
+    """
+    One-pass index over a Figma document: node id to node, parent, page and nearest FRAME ancestor.
+    Built iteratively, so deeply nested files cannot hit the recursion limit.
+    """
+
+    def __init__(self, document: Dict):
+        self.document = document
+        self.nodes = {}
+        self.parents = {}
+        self.pages = {}
+        self.frames = {}
+
+        root = document.get("document", document)
+        self.page_ids = [page["id"] for page in root.get("children", [])]
+
+        # (node, parent id, page id, nearest frame id)
+        stack = [(page, None, page["id"], None) for page in reversed(root.get("children", []))]
+        while stack:
+            node, parent_id, page_id, frame_id = stack.pop()
+            node_id = node.get("id")
+            if node.get("type") == "FRAME":
+                frame_id = node_id
+            self.nodes[node_id] = node
+            self.parents[node_id] = parent_id
+            self.pages[node_id] = page_id
+            self.frames[node_id] = frame_id
+            for child in reversed(node.get("children", [])):
+                stack.append((child, node_id, page_id, frame_id))
+
+    def get(self, node_id: str) -> Optional[Dict]:
+        return self.nodes.get(node_id)
+
+    def parent(self, node_id: str) -> Optional[Dict]:
+        return self.nodes.get(self.parents.get(node_id))
+
+    def page(self, node_id: str) -> Optional[Dict]:
+        return self.nodes.get(self.pages.get(node_id))
+
+    def nearest_frame(self, node_id: str) -> Optional[Dict]:
+        """The node itself if it is a FRAME, otherwise its closest FRAME ancestor."""
+        return self.nodes.get(self.frames.get(node_id))
+
+    @staticmethod
+    def top_level_frames(container_node: Dict) -> List[Dict]:
+        return [child for child in container_node.get("children", [])
+                if child.get("type") == "FRAME"]
+
+    def default_frames(self) -> List[Dict]:
+        """Top-level frames of the first page that has any."""
+        for page_id in self.page_ids:
+            frames = self.top_level_frames(self.nodes[page_id])
+            if frames:
+                return frames
+        return []
+
+    def frames_for(self, node_id: Optional[str]) -> List[Dict]:
+        """
+        Frames to export for a target node: the node itself if it is a frame, its top-level frames,
+        its nearest frame ancestor, the top-level frames of its page, or the document's default frames.
+        """
+        target = self.get(node_id) if node_id else None
+        if not target:
+            return self.default_frames()
+
+        if target.get("type") == "FRAME":
+            return [target]
+
+        frames = self.top_level_frames(target)
+        if frames:
+            return frames
+
+        frame = self.nearest_frame(node_id)
+        if frame:
+            return [frame]
+
+        page = self.page(node_id)
+        frames = self.top_level_frames(page) if page else []
+        return frames or self.default_frames()
@@ -0,0 +1,101 @@
+import hashlib
+import json
+from typing import Dict, Optional
+from image_store import image_store
+
+# Review kinds stored per frame snapshot
+DESIGN_REVIEW = "design_review"
+TONE_REVIEW = "tone_review"
+
+
+def subtree_hash(node: Dict) -> Optional[str]:
+    """
+    Hash of a frame node and everything below it.
+    None when the node was fetched without its children (depth-limited requests),
+    since such a hash would not see changes inside the frame.
+    """
+    if "children" not in node:
+        return None
+    return hashlib.sha256(json.dumps(node, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def frame_state(image_url: str) -> Optional[Dict]:
+    """
+    Identity and content hashes of the Figma frame behind an image link:
+    key ("file_id:node_id"), name, version, image digest and subtree hash.
+    None for images that did not come from an extraction.
+    """
+    digest = image_store.resolve(image_url)
+    frame = image_store.frame_for(digest) if digest else None
+    if not frame:
+        return None
+    return {
+        "key": f"{frame['file_id']}:{frame['node_id']}",
+        "name": frame.get("name") or frame["node_id"],
+        "version": frame.get("version"),
+        "digest": digest,
+        "subtree": frame.get("subtree"),
+    }
+
+
+def is_unchanged(state: Dict, snapshot: Dict) -> bool:
+    """A frame is unchanged if it renders to the same image or its node subtree hashes the same."""
+    if snapshot.get("digest") == state["digest"]:
+        return True
+    return bool(state["subtree"]) and snapshot.get("subtree") == state["subtree"]
+
+
+def previous_review(snapshots: Dict, kind: str, state: Optional[Dict]) -> Optional[str]:
+    """Output of the last review of this kind if the frame has not changed since."""
+    if not state or snapshots is None:
+        return None
+    snapshot = snapshots.get(state["key"])
+    if not snapshot or not is_unchanged(state, snapshot):
+        return None
+    return snapshot.get("reviews", {}).get(kind)
+
+
+def record_review(snapshots: Dict, kind: str, state: Optional[Dict], output: str):
+    """Remember a frame's review output against its current image and subtree hashes."""
+    if not state or snapshots is None or not output.strip():
+        return
+    # The review agents report failures as a trailing "Error: ..." line, never cache those
+    if output.strip().splitlines()[-1].startswith("Error:"):
+        return
+    snapshot = snapshots.get(state["key"])
+    if not snapshot or not is_unchanged(state, snapshot):
+        # Reviews of other kinds describe the old frame, drop them
+        snapshot = {"reviews": {}}
+    snapshot.update({
+        "name": state["name"],
+        "version": state["version"],
+        "digest": state["digest"],
+        "subtree": state["subtree"],
+    })
+    snapshot["reviews"][kind] = output
+    snapshots[state["key"]] = snapshot
+
+
+def merge_snapshots(stored: Dict, original: Dict, updated: Dict) -> bool:
+    """
+    Apply the snapshots changed between `original` and `updated` onto `stored`, the copy saved meanwhile
+    by concurrent reviews. New reviews of a frame that is unchanged in `stored` are added to its reviews,
+    a frame that changed is replaced. Returns whether `stored` was modified.
+    """
+    modified = False
+    for key, snapshot in updated.items():
+        before = original.get(key)
+        if before == snapshot:
+            continue
+        previous_reviews = before.get("reviews", {}) if before and is_unchanged(snapshot, before) else {}
+        new_reviews = {
+            kind: output for kind, output in snapshot.get("reviews", {}).items() if previous_reviews.get(kind) != output
+        }
+        current = stored.get(key)
+        if current and is_unchanged(snapshot, current):
+            current = {**current, "reviews": {**current.get("reviews", {}), **new_reviews}}
+            stored[key] = current
+        else:
+            stored[key] = snapshot
+        modified = True
+    return modified
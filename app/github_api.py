@@ -0,0 +1,144 @@
+import json
+from typing import Callable, Dict, Generator, List, Optional, Set
+from logger import logger
+import upstream
+import metrics
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+REQUEST_TIMEOUT = 60
+# Changed files per files page
+FILES_PAGE_SIZE = 100
+# PRs whose files are requested together in one aliased query
+FILES_BATCH_SIZE = 20
+
+# Selected by every query so each response reports what it cost
+RATE_LIMIT_FIELDS = """
+  rateLimit {
+    cost
+    remaining
+  }
+"""
+
+FILES_QUERY = """
+query PRFiles($id: ID!, $first: Int!, $after: String) {
+""" + RATE_LIMIT_FIELDS + """
+  node(id: $id) {
+    ... on PullRequest {
+      files(first: $first, after: $after) {
+        pageInfo {
+          hasNextPage
+          endCursor
+        }
+        nodes {
+          path
+        }
+      }
+    }
+  }
+}
+"""
+
+
+def auth_headers(github_token: str) -> Dict[str, str]:
+    return {"Authorization": f"bearer {github_token}"}
+
+
+def graphql(headers: Dict, query: str, variables: Dict, usage: Optional[Dict] = None) -> Dict:
+    """
+    Run a GraphQL query over the pooled GitHub session and return its data, raising on errors.
+    The rate limit cost is added to `usage` ({"cost", "remaining"}) when given.
+    """
+    response = upstream.post(
+        "github", GRAPHQL_URL, json={"query": query, "variables": variables}, headers=headers, timeout=REQUEST_TIMEOUT
+    )
+    logger.info(f"Response Status: {response.status_code}")
+
+    if response.status_code != 200:
+        error_msg = f"GraphQL query failed with status {response.status_code}: {response.text}"
+        logger.error(error_msg)
+        raise Exception(error_msg)
+
+    data = response.json()
+    if "errors" in data:
+        logger.error(f"GraphQL Errors: {json.dumps(data['errors'], indent=2)}")
+        raise Exception(f"GraphQL query returned errors: {data['errors']}")
+
+    rate_limit = (data["data"] or {}).get("rateLimit")
+    if rate_limit:
+        logger.info(f"GraphQL cost {rate_limit['cost']}, {rate_limit['remaining']} points remaining")
+        metrics.increment("github.graphql_cost", rate_limit["cost"])
+        if usage is not None:
+            usage["cost"] = usage.get("cost", 0) + rate_limit["cost"]
+            usage["remaining"] = rate_limit["remaining"]
+    return data["data"]
+
+
+def file_pages(headers: Dict, pr_id: str, files: Dict) -> Generator[List[str], None, None]:
+    """
+    Changed file paths of a PR, one page at a time: first the page already fetched with the PR,
+    then further pages by cursor. Stop iterating to skip the remaining requests.
+    """
+    files = files or {}
+    while True:
+        yield [node["path"] for node in files.get("nodes") or []]
+        page_info = files.get("pageInfo") or {}
+        if not page_info.get("hasNextPage"):
+            return
+        data = graphql(headers, FILES_QUERY, {
+            "id": pr_id,
+            "first": FILES_PAGE_SIZE,
+            "after": page_info.get("endCursor"),
+        })
+        files = (data.get("node") or {}).get("files") or {}
+
+
+def _files_batch_query(count: int) -> str:
+    """One query fetching a page of changed files for `count` PRs, aliased pr0..prN."""
+    params = ", ".join(f"$id{i}: ID!, $after{i}: String" for i in range(count))
+    fields = "\n".join(
+        f"""
+  pr{i}: node(id: $id{i}) {{
+    ... on PullRequest {{
+      files(first: $first, after: $after{i}) {{
+        pageInfo {{
+          hasNextPage
+          endCursor
+        }}
+        nodes {{
+          path
+        }}
+      }}
+    }}
+  }}"""
+        for i in range(count)
+    )
+    return f"query PRFilesBatch($first: Int!, {params}) {{{RATE_LIMIT_FIELDS}{fields}\n}}"
+
+
+def prs_touching(headers: Dict, pr_ids: List[str], matches: Callable[[str], bool], usage: Optional[Dict] = None) -> Set[str]:
+    """
+    Ids of the PRs that change at least one file for which `matches(path)` is true.
+    Files of up to FILES_BATCH_SIZE PRs are fetched per aliased query, a PR drops out as soon as
+    a matching file is seen or its files run out, the rest continue with their next page.
+    """
+    cursors = {pr_id: None for pr_id in pr_ids}
+    found = set()
+    while cursors:
+        batch = list(cursors)[:FILES_BATCH_SIZE]
+        variables = {"first": FILES_PAGE_SIZE}
+        for i, pr_id in enumerate(batch):
+            variables[f"id{i}"] = pr_id
+            variables[f"after{i}"] = cursors[pr_id]
+        data = graphql(headers, _files_batch_query(len(batch)), variables, usage)
+
+        for i, pr_id in enumerate(batch):
+            files = (data.get(f"pr{i}") or {}).get("files") or {}
+            page_info = files.get("pageInfo") or {}
+            if any(matches(node["path"]) for node in files.get("nodes") or []):
+                found.add(pr_id)
+                del cursors[pr_id]
+            elif page_info.get("hasNextPage"):
+                cursors[pr_id] = page_info.get("endCursor")
+            else:
+                del cursors[pr_id]
+    return found
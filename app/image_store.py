@@ -0,0 +1,222 @@
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+from logger import logger
+import upstream
+
+STORE_DIR = os.path.join("cache", "images")
+MAX_STORE_BYTES = 512 * 1024 * 1024
+REQUEST_TIMEOUT = 60
+# Largest image downloaded into the store
+MAX_IMAGE_BYTES = 32 * 1024 * 1024
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+# Raster types only, anything else (HTML, SVG with scripts) must never be served from the app's origin
+ALLOWED_CONTENT_TYPES = ("image/png", "image/jpeg", "image/gif", "image/webp")
+
+# Hosts the Figma images API hands out render links on, only these are downloaded for links from a message
+FIGMA_RENDER_HOST_PATTERN = re.compile(r"(figma-alpha-api\.s3\.[a-z0-9-]+\.amazonaws\.com|[a-z0-9-]+\.figma\.com)")
+
+# Images in the store are served to the client from this path
+LOCAL_URL_PREFIX = "/api/image/"
+LOCAL_URL_PATTERN = re.compile(r"/api/image/([0-9a-f]{64})")
+
+
+class ImageStore:
+    """
+    Content-addressed store for exported Figma frames.
+
+    Blobs are saved once under their SHA-256, so identical renders are deduplicated.
+    The index maps source URLs and (file, node, version) to blobs and tracks sizes and last access,
+    and the least recently used blobs are evicted once the store grows past `max_bytes`.
+    """
+
+    def __init__(self, store_dir: str = STORE_DIR, max_bytes: int = MAX_STORE_BYTES):
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(store_dir, "index.json")
+        self._index = self._load_index()
+
+    def _load_index(self) -> Dict:
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        for section in ("blobs", "urls", "nodes", "frames"):
+            index.setdefault(section, {})
+        return index
+
+    def _save_index(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp_path = f"{self._index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.store_dir, digest[:2], digest)
+
+    @staticmethod
+    def node_key(file_id: str, node_id: str, version: str, render: str = "") -> str:
+        """Index key of a frame render, `render` names the export settings (e.g. "2x.jpg")."""
+        key = f"{file_id}:{node_id}@{version}"
+        return f"{key}/{render}" if render else key
+
+    def _evict(self):
+        """Drop least recently used blobs until the store fits its size budget. Caller holds the lock."""
+        blobs = self._index["blobs"]
+        total = sum(blob["size"] for blob in blobs.values())
+        if total <= self.max_bytes:
+            return
+
+        for digest, blob in sorted(blobs.items(), key=lambda item: item[1]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+            total -= blob["size"]
+            del blobs[digest]
+            logger.debug(f"Evicted image {digest}")
+
+        # Forget references to evicted blobs
+        for section in ("urls", "nodes"):
+            self._index[section] = {key: digest for key, digest in self._index[section].items() if digest in blobs}
+        self._index["frames"] = {digest: frame for digest, frame in self._index["frames"].items() if digest in blobs}
+
+    def put(self, data: bytes, content_type: str = "image/png", source_url: str = None, node_key: str = None, frame: Dict = None) -> str:
+        """
+        Store image bytes and return their SHA-256 digest.
+        `frame` describes the Figma frame rendered to this image (file_id, node_id, version, name, subtree).
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+
+        with self._lock:
+            if digest not in self._index["blobs"] or not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(data)
+            self._index["blobs"][digest] = {
+                "size": len(data),
+                "content_type": content_type,
+                "last_access": time.time(),
+            }
+            if source_url:
+                self._index["urls"][source_url] = digest
+            if node_key:
+                self._index["nodes"][node_key] = digest
+            if frame:
+                self._index["frames"][digest] = frame
+            self._evict()
+            self._save_index()
+        return digest
+
+    def fetch(self, url: str, node_key: str = None, frame: Dict = None) -> str:
+        """Download an image once and return its digest, later calls for the same URL hit the store."""
+        digest = self.resolve(url)
+        if digest:
+            if node_key or frame:
+                with self._lock:
+                    if node_key:
+                        self._index["nodes"][node_key] = digest
+                    if frame:
+                        self._index["frames"][digest] = frame
+                    self._save_index()
+            return digest
+
+        # Render links are single-use, there is nothing to revalidate
+        response = upstream.get("figma", url, timeout=REQUEST_TIMEOUT, conditional=False, stream=True)
+        try:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "image/png").split(";")[0].strip().lower()
+            if content_type not in ALLOWED_CONTENT_TYPES:
+                raise ValueError(f"Refusing to store {content_type} from {url}")
+            if int(response.headers.get("Content-Length") or 0) > MAX_IMAGE_BYTES:
+                raise ValueError(f"Image at {url} is larger than {MAX_IMAGE_BYTES} bytes")
+
+            data = bytearray()
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                data.extend(chunk)
+                if len(data) > MAX_IMAGE_BYTES:
+                    raise ValueError(f"Image at {url} is larger than {MAX_IMAGE_BYTES} bytes")
+        finally:
+            response.close()
+        return self.put(bytes(data), content_type, source_url=url, node_key=node_key, frame=frame)
+
+    @staticmethod
+    def is_render_url(url: str) -> bool:
+        """Whether a link points at a Figma render host, the only remote images the server downloads itself."""
+        parts = urlsplit(url)
+        return parts.scheme == "https" and bool(FIGMA_RENDER_HOST_PATTERN.fullmatch(parts.hostname or ""))
+
+    def resolve_or_fetch(self, url: str) -> Optional[str]:
+        """
+        Digest for an image link taken from a message: stored images and Figma render links are resolved,
+        any other link is left for the model provider to fetch and gives None.
+        """
+        digest = self.resolve(url)
+        if digest is None and self.is_render_url(url):
+            digest = self.fetch(url)
+        return digest
+
+    def resolve(self, url: str) -> Optional[str]:
+        """Digest of a stored image for a local image URL or an already downloaded source URL."""
+        local = LOCAL_URL_PATTERN.search(url)
+        with self._lock:
+            digest = local.group(1) if local else self._index["urls"].get(url)
+            if digest and digest in self._index["blobs"] and os.path.exists(self._blob_path(digest)):
+                return digest
+        return None
+
+    def lookup_node(self, file_id: str, node_id: str, version: str, render: str = "") -> Optional[str]:
+        with self._lock:
+            return self._index["nodes"].get(self.node_key(file_id, node_id, version, render))
+
+    def frame_for(self, digest: str) -> Optional[Dict]:
+        """The Figma frame most recently rendered to this image, if it came from an extraction."""
+        with self._lock:
+            frame = self._index["frames"].get(digest)
+            return dict(frame) if frame else None
+
+    def read(self, digest: str) -> Tuple[bytes, str]:
+        """Bytes and content type of a stored image."""
+        with self._lock:
+            blob = self._index["blobs"].get(digest)
+            if blob is None:
+                raise KeyError(digest)
+            blob["last_access"] = time.time()
+        with open(self._blob_path(digest), "rb") as f:
+            return f.read(), blob["content_type"]
+
+    def data_url(self, digest: str) -> str:
+        data, content_type = self.read(digest)
+        return f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+    @staticmethod
+    def local_url(digest: str) -> str:
+        return f"{LOCAL_URL_PREFIX}{digest}"
+
+    def vision_url(self, url: str) -> str:
+        """
+        URL to hand to the vision model for an image link: a data URL from local bytes when possible,
+        otherwise the original link.
+        """
+        try:
+            digest = self.resolve_or_fetch(url)
+            if digest:
+                return self.data_url(digest)
+        except Exception as e:
+            logger.warning(f"Falling back to remote image URL for {url}: {str(e)}")
+        return url
+
+
+image_store = ImageStore()
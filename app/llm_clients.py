@@ -0,0 +1,97 @@
+import threading
+import httpx
+from openai import OpenAI
+from logger import logger
+
+# Connection pool defaults, overridable from the settings page
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_MAX_CONNECTIONS = 20
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 10
+
+_lock = threading.Lock()
+_clients = {}
+_pool_config = {
+    "timeout": DEFAULT_TIMEOUT,
+    "max_connections": DEFAULT_MAX_CONNECTIONS,
+    "max_keepalive_connections": DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+}
+
+
+def _build_client(api_endpoint: str, api_key: str) -> OpenAI:
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=_pool_config["max_connections"],
+            max_keepalive_connections=_pool_config["max_keepalive_connections"],
+        ),
+        timeout=httpx.Timeout(_pool_config["timeout"], connect=DEFAULT_CONNECT_TIMEOUT),
+    )
+    return OpenAI(base_url=api_endpoint, api_key=api_key, http_client=http_client)
+
+
+def _pool_key():
+    return (_pool_config["timeout"], _pool_config["max_connections"], _pool_config["max_keepalive_connections"])
+
+
+def get_client(api_endpoint: str, api_key: str) -> OpenAI:
+    """
+    Return the shared OpenAI client for an endpoint, key and pool configuration, creating it on first use.
+    Clients are thread-safe, so every request and agent reuses the same keep-alive pool.
+    """
+    key = (api_endpoint, api_key, _pool_key())
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        key = (api_endpoint, api_key, _pool_key())
+        client = _clients.get(key)
+        if client is None:
+            logger.info(f"Creating pooled OpenAI client for {api_endpoint}")
+            client = _build_client(api_endpoint, api_key)
+            _clients[key] = client
+        return client
+
+
+def _retire(matches):
+    """
+    Drop matching clients from the cache. They are not closed: closing the pool would cut off
+    streams still running on it, its connections are released by garbage collection once the
+    last request using it finishes.
+    Caller holds the lock.
+    """
+    retired = [key for key in _clients if matches(key)]
+    for key in retired:
+        del _clients[key]
+    if retired:
+        logger.info(f"Retired {len(retired)} pooled OpenAI client(s)")
+
+
+def retire_client(api_endpoint: str, api_key: str):
+    """Stop handing out the clients of an endpoint and key, e.g. after the credentials changed."""
+    with _lock:
+        _retire(lambda key: key[:2] == (api_endpoint, api_key))
+
+
+def configure_clients(timeout=None, max_connections=None, max_keepalive_connections=None):
+    """
+    Update the pool limits and timeout used for new clients.
+    Clients built with another configuration are retired only when the configuration actually changes.
+    """
+    new_config = {
+        "timeout": float(timeout) if timeout is not None else DEFAULT_TIMEOUT,
+        "max_connections": int(max_connections) if max_connections is not None else DEFAULT_MAX_CONNECTIONS,
+        "max_keepalive_connections": (
+            int(max_keepalive_connections) if max_keepalive_connections is not None
+            else DEFAULT_MAX_KEEPALIVE_CONNECTIONS
+        ),
+    }
+
+    with _lock:
+        if new_config == _pool_config:
+            return
+        _pool_config.update(new_config)
+        current = _pool_key()
+        _retire(lambda key: key[2] != current)
+
+    logger.info(f"OpenAI client pool reconfigured: {new_config}")
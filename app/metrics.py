@@ -0,0 +1,31 @@
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+
+
+def increment(name: str, amount: int = 1):
+    """Add `amount` to a named counter."""
+    with _lock:
+        _counters[name] += amount
+
+
+def observe(name: str, value: float):
+    """Record one observation (e.g. a duration in milliseconds) for a named timing."""
+    with _lock:
+        timing = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        timing["count"] += 1
+        timing["total"] += value
+        timing["max"] = max(timing["max"], value)
+
+
+def snapshot() -> dict:
+    """Return a copy of every counter and timing, with averages, for the metrics endpoint."""
+    with _lock:
+        timings = {
+            name: {**timing, "avg": timing["total"] / timing["count"] if timing["count"] else 0.0}
+            for name, timing in _timings.items()
+        }
+        return {"counters": dict(_counters), "timings": timings}
@@ -0,0 +1,31 @@
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_last_message_at(apps, schema_editor):
+    """Set each thread's last_message_at to its newest message, or its creation time without one."""
+    Thread = apps.get_model("app", "Thread")
+    Message = apps.get_model("app", "Message")
+    latest = Message.objects.filter(thread=models.OuterRef("pk")).order_by("-created_on").values("created_on")[:1]
+    Thread.objects.update(last_message_at=Coalesce(models.Subquery(latest), models.F("created_on")))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thread",
+            name="last_message_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_last_message_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="thread",
+            index=models.Index(fields=["last_message_at", "id"], name="thread_last_message_idx"),
+        ),
+    ]
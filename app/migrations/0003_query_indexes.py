@@ -0,0 +1,37 @@
+from django.db import migrations, models
+
+
+def dedupe_settings(apps, schema_editor):
+    """Keep the most recent row of each settings key, so the key can become unique."""
+    Settings = apps.get_model("app", "Settings")
+    duplicated = (
+        Settings.objects.values("key")
+        .annotate(count=models.Count("id"), latest=models.Max("id"))
+        .filter(count__gt=1)
+    )
+    for row in duplicated:
+        Settings.objects.filter(key=row["key"]).exclude(id=row["latest"]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0002_thread_last_message_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_settings, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="settings",
+            name="key",
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["thread", "created_on", "id"], name="message_thread_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="thread",
+            index=models.Index(fields=["edited_on"], name="thread_edited_idx"),
+        ),
+    ]
@@ -1,4 +1,6 @@
-from openai import OpenAI
+from llm_clients import get_client
+from streaming import stream_completion
+from context import build_messages
 from typing import Generator
 from logger import logger
 
@@ -9,7 +11,7 @@ def get_more_info(
     thread_messages: list = None
 ) -> Generator[str, None, None]:
     try:
-        client = OpenAI(base_url=api_endpoint, api_key=api_key)
+        client = get_client(api_endpoint, api_key)
         
         system_prompt = """
 You are a helpful AI assistant tasked with gathering more specific information from users.
@@ -50,18 +52,7 @@ For general development questions:
 Remember to maintain context from previous messages and only ask for information that hasn't already been provided.
 """.strip()
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-        ]
-
-        if thread_messages:
-            for msg in thread_messages:
-                if not msg["message"].strip():
-                    continue
-                messages.append({
-                    "role": msg["sender"].lower(),
-                    "content": msg["message"]
-                })
+        messages, _ = build_messages("more_info", api_model, thread_messages, system_prompt)
 
         stream = client.chat.completions.create(
             model=api_model,
@@ -69,33 +60,7 @@ Remember to maintain context from previous messages and only ask for information
             stream=True
         )
 
-        buffer = ""
-        for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
-                content = chunk.choices[0].delta.content
-                # Add to buffer
-                buffer += content
-                
-                # If we have a newline or sufficient content, process and yield
-                if '\n' in buffer or len(buffer) > 80:
-                    # Split by newlines to preserve them
-                    parts = buffer.split('\n')
-                    
-                    # Process all parts except the last one
-                    for part in parts[:-1]:
-                        # Normalize spaces while preserving intentional newlines
-                        normalized = ' '.join(part.split())
-                        if normalized:
-                            yield normalized + '\n'
-                    
-                    # Keep the last part in buffer
-                    buffer = parts[-1]
-        
-        # Process any remaining content in buffer
-        if buffer:
-            normalized = ' '.join(buffer.split())
-            if normalized:
-                yield normalized
+        yield from stream_completion(stream)
 
     except Exception as e:
         error_msg = f"Error in more_info agent: {str(e)}"
@@ -0,0 +1,347 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence
+from github_api import FILES_PAGE_SIZE, RATE_LIMIT_FIELDS, file_pages, graphql
+from logger import logger
+import metrics
+
+DB_PATH = os.path.join("cache", "github", "prs.sqlite3")
+SYNC_PAGE_SIZE = 50
+# The search API stops after this many results, longer syncs restart from the last updatedAt seen
+SEARCH_RESULT_LIMIT = 1000
+# Lookups within this many seconds of the last sync are answered without asking GitHub
+MIN_SYNC_INTERVAL_SECONDS = 60
+
+SYNC_QUERY = """
+query SyncPRs($query: String!, $first: Int!, $after: String, $filesFirst: Int!) {
+""" + RATE_LIMIT_FIELDS + """
+  search(first: $first, after: $after, query: $query, type: ISSUE) {
+    pageInfo {
+      hasNextPage
+      endCursor
+    }
+    nodes {
+      ... on PullRequest {
+        id
+        number
+        title
+        body
+        url
+        state
+        createdAt
+        updatedAt
+        additions
+        deletions
+        author {
+          ... on User {
+            login
+            name
+          }
+        }
+        files(first: $filesFirst) {
+          pageInfo {
+            hasNextPage
+            endCursor
+          }
+          nodes {
+            path
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prs (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    repo TEXT NOT NULL,
+    number INTEGER,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL DEFAULT '',
+    state TEXT,
+    author_login TEXT,
+    author_name TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    additions INTEGER,
+    deletions INTEGER
+);
+CREATE INDEX IF NOT EXISTS prs_repo_created ON prs (repo, created_at);
+CREATE INDEX IF NOT EXISTS prs_repo_author ON prs (repo, author_login COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS pr_files (
+    pr_id INTEGER NOT NULL REFERENCES prs (id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    PRIMARY KEY (pr_id, path)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    repo TEXT PRIMARY KEY,
+    last_updated_at TEXT,
+    synced_at REAL
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS prs_fts USING fts5 (title, body, content='prs', content_rowid='id');
+
+CREATE TRIGGER IF NOT EXISTS prs_ai AFTER INSERT ON prs BEGIN
+    INSERT INTO prs_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS prs_ad AFTER DELETE ON prs BEGIN
+    INSERT INTO prs_fts (prs_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS prs_au AFTER UPDATE ON prs BEGIN
+    INSERT INTO prs_fts (prs_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    INSERT INTO prs_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+"""
+
+
+class PRMirror:
+    """
+    Local SQLite mirror of pull request metadata and changed file paths, per repository.
+
+    Repositories are synced incrementally by updatedAt, so each sync only downloads PRs that changed.
+    Titles and bodies are indexed with FTS5, so lookups by date, author, term and changed file
+    extensions are answered locally. A repository is only searched locally once a full sync completed.
+    """
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._write_lock = threading.Lock()
+        self._sync_locks = {}
+        self._ready = None
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA foreign_keys = ON")
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def available(self) -> bool:
+        """Create the schema on first use, False if SQLite lacks FTS5 or the file cannot be opened."""
+        if self._ready is None:
+            try:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                with self._connect() as connection:
+                    connection.execute("PRAGMA journal_mode = WAL")
+                    connection.executescript(SCHEMA)
+                self._ready = True
+            except sqlite3.Error as e:
+                logger.warning(f"PR mirror disabled: {str(e)}")
+                self._ready = False
+        return self._ready
+
+    def _state(self, repo: str) -> Optional[sqlite3.Row]:
+        with self._connect() as connection:
+            return connection.execute("SELECT * FROM sync_state WHERE repo = ?", (repo,)).fetchone()
+
+    def is_synced(self, repo: str) -> bool:
+        """Whether a full sync of the repository has completed at least once."""
+        if not self.available():
+            return False
+        state = self._state(repo)
+        return bool(state and state["synced_at"])
+
+    def _save_prs(self, repo: str, prs: List[Dict], files: Dict[str, List[str]]):
+        with self._write_lock, self._connect() as connection:
+            for pr in prs:
+                author = pr.get("author") or {}
+                row = connection.execute(
+                    """
+                    INSERT INTO prs (url, repo, number, title, body, state, author_login, author_name,
+                                     created_at, updated_at, additions, deletions)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (url) DO UPDATE SET
+                        title = excluded.title, body = excluded.body, state = excluded.state,
+                        author_login = excluded.author_login, author_name = excluded.author_name,
+                        updated_at = excluded.updated_at, additions = excluded.additions,
+                        deletions = excluded.deletions
+                    RETURNING id
+                    """,
+                    (
+                        pr["url"], repo, pr.get("number"), pr["title"], pr.get("body") or "", pr.get("state"),
+                        author.get("login"), author.get("name"), pr.get("createdAt"), pr.get("updatedAt"),
+                        pr.get("additions", 0), pr.get("deletions", 0),
+                    ),
+                ).fetchone()
+                connection.execute("DELETE FROM pr_files WHERE pr_id = ?", (row["id"],))
+                connection.executemany(
+                    "INSERT OR IGNORE INTO pr_files (pr_id, path) VALUES (?, ?)",
+                    [(row["id"], path) for path in files.get(pr["url"], [])],
+                )
+            if prs:
+                connection.execute(
+                    """
+                    INSERT INTO sync_state (repo, last_updated_at) VALUES (?, ?)
+                    ON CONFLICT (repo) DO UPDATE SET last_updated_at = excluded.last_updated_at
+                    """,
+                    (repo, prs[-1]["updatedAt"]),
+                )
+            connection.commit()
+
+    def _mark_synced(self, repo: str):
+        with self._write_lock, self._connect() as connection:
+            connection.execute(
+                """
+                INSERT INTO sync_state (repo, synced_at) VALUES (?, ?)
+                ON CONFLICT (repo) DO UPDATE SET synced_at = excluded.synced_at
+                """,
+                (repo, time.time()),
+            )
+            connection.commit()
+
+    def sync(self, repo: str, headers: Dict, force: bool = False) -> int:
+        """
+        Download PRs of `repo` ("owner/name") updated since the last sync and return how many were saved.
+        Skipped when another sync of the repository is running or the last one is recent, unless forced.
+        """
+        if not self.available():
+            return 0
+
+        lock = self._sync_locks.setdefault(repo, threading.Lock())
+        if not lock.acquire(blocking=False):
+            logger.info(f"Sync of {repo} already running")
+            return 0
+
+        try:
+            state = self._state(repo)
+            if not force and state and state["synced_at"] and time.time() - state["synced_at"] < MIN_SYNC_INTERVAL_SECONDS:
+                return 0
+
+            started = time.monotonic()
+            saved = 0
+            since = state["last_updated_at"] if state else None
+            while True:
+                # Oldest changes first, so the high-water mark only moves forward
+                query = f"repo:{repo} is:pr sort:updated-asc"
+                if since:
+                    query += f" updated:>={since}"
+                variables = {"query": query, "first": SYNC_PAGE_SIZE, "after": None, "filesFirst": FILES_PAGE_SIZE}
+
+                seen = 0
+                restart = False
+                complete = True
+                while True:
+                    search = graphql(headers, SYNC_QUERY, variables)["search"]
+                    prs = [node for node in search["nodes"] if node]
+                    files = {}
+                    for pr in prs:
+                        paths = []
+                        for page in file_pages(headers, pr["id"], pr.get("files")):
+                            paths.extend(page)
+                        files[pr["url"]] = paths
+                    self._save_prs(repo, prs, files)
+                    saved += len(prs)
+                    seen += len(search["nodes"])
+
+                    page_info = search.get("pageInfo") or {}
+                    # At the cap GitHub reports no next page although results remain, so check it first
+                    if seen >= SEARCH_RESULT_LIMIT and prs:
+                        if prs[-1]["updatedAt"] == since:
+                            # Over a capped page of PRs updated within one second, the window cannot narrow further
+                            logger.warning(f"Sync of {repo} stuck at updated:>={since}, leaving the mirror unsynced")
+                            complete = False
+                            break
+                        # Continue past the search cap with a new query from the latest update seen
+                        since = prs[-1]["updatedAt"]
+                        restart = True
+                        break
+                    if not page_info.get("hasNextPage"):
+                        break
+                    variables["after"] = page_info.get("endCursor")
+
+                if not restart:
+                    break
+
+            # Only a query that ran out of results below the cap covers the whole repository
+            if complete:
+                self._mark_synced(repo)
+            elapsed_ms = (time.monotonic() - started) * 1000
+            logger.info(f"Synced {saved} PR(s) of {repo} in {elapsed_ms:.0f}ms")
+            metrics.increment("pr_mirror.synced_prs", saved)
+            metrics.observe("pr_mirror.sync_ms", elapsed_ms)
+            return saved
+        finally:
+            lock.release()
+
+    def search(
+        self,
+        repo: str,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        author: Optional[str] = None,
+        search_term: Optional[str] = None,
+        extensions: Sequence[str] = (),
+        limit: int = 100,
+        order: str = "relevance",
+    ) -> List[Dict]:
+        """
+        PRs of a synced repository matching the same filters as the live search, in the live API's shape.
+        With a search term and the "relevance" order the best matches come first, otherwise the newest.
+        """
+        started = time.monotonic()
+        joins = ""
+        conditions = ["prs.repo = ?"]
+        params = [repo]
+        order_by = "prs.created_at DESC"
+
+        if search_term:
+            # One quoted phrase, like the live search
+            joins = "JOIN prs_fts ON prs_fts.rowid = prs.id"
+            conditions.append("prs_fts MATCH ?")
+            params.append('"' + search_term.replace('"', '""') + '"')
+            if order == "relevance":
+                order_by = "bm25(prs_fts), prs.created_at DESC"
+
+        if start_date:
+            conditions.append("substr(prs.created_at, 1, 10) >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("substr(prs.created_at, 1, 10) <= ?")
+            params.append(end_date)
+        if author:
+            conditions.append("prs.author_login = ? COLLATE NOCASE")
+            params.append(author)
+        if extensions:
+            matches = " OR ".join("lower(pr_files.path) LIKE ?" for _ in extensions)
+            conditions.append(f"EXISTS (SELECT 1 FROM pr_files WHERE pr_files.pr_id = prs.id AND ({matches}))")
+            params.extend(f"%{extension.lower()}" for extension in extensions)
+
+        sql = f"""
+            SELECT prs.* FROM prs {joins}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {order_by}
+            LIMIT ?
+        """
+        params.append(limit)
+
+        with self._connect() as connection:
+            rows = connection.execute(sql, params).fetchall()
+
+        metrics.observe("pr_mirror.search_ms", (time.monotonic() - started) * 1000)
+        return [
+            {
+                "title": row["title"],
+                "url": row["url"],
+                "state": row["state"],
+                "createdAt": row["created_at"],
+                "updatedAt": row["updated_at"],
+                "additions": row["additions"],
+                "deletions": row["deletions"],
+                "author": {"login": row["author_login"], "name": row["author_name"]} if row["author_login"] else None,
+            }
+            for row in rows
+        ]
+
+
+pr_mirror = PRMirror()
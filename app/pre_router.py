@@ -0,0 +1,145 @@
+import re
+from typing import List, NamedTuple, Optional
+from figma_cache import FIGMA_FILE_PATH
+from logger import logger
+
+FIGMA_DESIGN_URL_PATTERN = re.compile(r"https?://(?:www\.)?figma\.com/" + FIGMA_FILE_PATH + r"\S*")
+TABLE_ROW_PATTERN = re.compile(r"^\|\s*(.*?)\s*\|\s*(\S+)\s*\|\s*$")
+SLASH_COMMAND_PATTERN = re.compile(r"^/(\w+)\b\s*(.*)$", re.DOTALL)
+
+# Only whole messages match these, anything longer, negated or scoped to some frames goes to the LLM router
+AFFIRMATIVE_PATTERN = re.compile(
+    r"(yes|yeah|yep|sure|ok|okay|go ahead|do it|please do|sounds good)(,? please)?[.!]*",
+    re.IGNORECASE,
+)
+REVIEW_COMMAND_PATTERN = re.compile(
+    r"(please )?(review|analy[sz]e|check) (it|them|(all )?(the )?(designs?|frames?|images?))( please)?[.!]*",
+    re.IGNORECASE,
+)
+TONE_COMMAND_PATTERN = re.compile(
+    r"(please )?(review|check) (the )?(tone|copy|text|wording)( of (it|them|the (designs?|frames?|images?)))?( please)?[.!]*",
+    re.IGNORECASE,
+)
+IMAGE_URL_PATTERN = re.compile(r"(https?://|/api/image/)\S+")
+
+# Action recorded on an assistant message once its Figma images have been extracted
+EXTRACT_ACTION = "extract_figma_images"
+
+
+class RouteDecision(NamedTuple):
+    """A routing decision in the same tag format the LLM router produces."""
+    routing_response: str
+    action: str
+    rule: str
+
+
+def _previous_assistant_message(thread_messages: list) -> Optional[dict]:
+    for msg in reversed(thread_messages or []):
+        if msg["sender"].lower() == "assistant" and msg["message"].strip():
+            return msg
+    return None
+
+
+def _extracted_image_urls(message: dict) -> List[str]:
+    """Image URLs from the markdown table of an extraction response."""
+    urls = []
+    for line in message["message"].splitlines():
+        row = TABLE_ROW_PATTERN.match(line.strip())
+        if not row:
+            continue
+        url = row.group(2)
+        if url.startswith("http") or url.startswith("/"):
+            urls.append(url)
+    return urls
+
+
+def _is_extraction(message: dict) -> bool:
+    route = (message.get("metadata") or {}).get("route") or {}
+    if route.get("action"):
+        return route["action"] == EXTRACT_ACTION
+    # Messages written before routes were recorded
+    return "| Frame Name | Image URL |" in message["message"]
+
+
+def _review_tags(tag: str, urls: List[str]) -> str:
+    return " ".join(f"<{tag}>{url}</{tag}>" for url in urls)
+
+
+def _images_from_previous_extraction(thread_messages: list) -> List[str]:
+    previous = _previous_assistant_message(thread_messages)
+    if previous and _is_extraction(previous):
+        return _extracted_image_urls(previous)
+    return []
+
+
+def _slash_command(command: str, argument: str, thread_messages: list, figma_token: str, github_token: str):
+    if command == "extract":
+        figma_url = FIGMA_DESIGN_URL_PATTERN.search(argument)
+        if figma_url and figma_token:
+            return RouteDecision(
+                f"<extract_images_from_figma>{figma_url.group(0)}</extract_images_from_figma>",
+                EXTRACT_ACTION,
+                "slash_command",
+            )
+
+    if command in ("review", "tone"):
+        tag = "review_design" if command == "review" else "tone_text_copy_review"
+        urls = [token for token in argument.split() if IMAGE_URL_PATTERN.fullmatch(token)]
+        if not argument.strip():
+            urls = _images_from_previous_extraction(thread_messages)
+        # Words without image URLs ("/review the header") are left to the LLM router to scope
+        if urls:
+            return RouteDecision(_review_tags(tag, urls), tag, "slash_command")
+
+    if command in ("pr", "prs") and argument.strip() and github_token:
+        return RouteDecision(
+            f"<pr_lookup><search_term>{argument.strip()}</search_term></pr_lookup>",
+            "pr_lookup",
+            "slash_command",
+        )
+
+    return None
+
+
+def pre_route(message: str, thread_messages: list = None, figma_token: str = None, github_token: str = None) -> Optional[RouteDecision]:
+    """
+    Route unambiguous turns without calling the LLM router.
+    Returns None when the turn needs the LLM router to decide.
+    """
+    text = (message or "").strip()
+    if not text:
+        return None
+
+    # Explicit slash-commands
+    command = SLASH_COMMAND_PATTERN.match(text)
+    if command:
+        decision = _slash_command(command.group(1).lower(), command.group(2), thread_messages, figma_token, github_token)
+        if decision:
+            logger.info(f"Pre-router matched /{command.group(1)}: {decision.action}")
+        return decision
+
+    # A message that is only a Figma design URL
+    figma_url = FIGMA_DESIGN_URL_PATTERN.fullmatch(text)
+    if figma_url and figma_token:
+        logger.info("Pre-router matched a bare Figma URL")
+        return RouteDecision(
+            f"<extract_images_from_figma>{text}</extract_images_from_figma>",
+            EXTRACT_ACTION,
+            "figma_url",
+        )
+
+    # Accepting the review offered after an image extraction
+    text = " ".join(text.split())
+    if TONE_COMMAND_PATTERN.fullmatch(text):
+        tag = "tone_text_copy_review"
+    elif AFFIRMATIVE_PATTERN.fullmatch(text) or REVIEW_COMMAND_PATTERN.fullmatch(text):
+        tag = "review_design"
+    else:
+        tag = None
+    if tag:
+        urls = _images_from_previous_extraction(thread_messages)
+        if urls:
+            logger.info(f"Pre-router matched a follow-up to an extraction: {tag}")
+            return RouteDecision(_review_tags(tag, urls), tag, "extraction_follow_up")
+
+    return None
@@ -0,0 +1,188 @@
+import threading
+import time
+from dataclasses import dataclass, field, fields
+from typing import Callable, Dict, Optional, Tuple
+from agent_design_review import DEFAULT_REVIEW_CONCURRENCY
+from agent_figma_extract import DEFAULT_EXPORT_FORMAT, DEFAULT_EXPORT_SCALE, EXPORT_FORMATS, MAX_EXPORT_SCALE, MIN_EXPORT_SCALE
+from agent_pr_lookup import DEFAULT_MAX_RESULTS, DEFAULT_REPOSITORIES, SORT_ORDERS, parse_repositories
+from agent_tone_review import DEFAULT_TONE_BATCH_SIZE
+from llm_clients import DEFAULT_MAX_CONNECTIONS, DEFAULT_MAX_KEEPALIVE_CONNECTIONS, DEFAULT_TIMEOUT
+from streaming import FlushPolicy
+from logger import logger
+
+# Settings that are never returned to the client in clear text
+SENSITIVE_KEYS = ("api_key", "weave_key", "github_token", "figma_token")
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+FALSE_VALUES = ("0", "false", "no", "off")
+
+
+def _integer(minimum: int):
+    def parse(value: str) -> int:
+        try:
+            number = int(value)
+        except ValueError:
+            raise ValueError("must be a whole number")
+        if number < minimum:
+            raise ValueError(f"must be at least {minimum}")
+        return number
+    return parse
+
+
+def _number(minimum: float, maximum: float = None):
+    def parse(value: str) -> float:
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError("must be a number")
+        if number < minimum or (maximum is not None and number > maximum):
+            raise ValueError(f"must be between {minimum:g} and {maximum:g}" if maximum is not None else f"must be at least {minimum:g}")
+        return number
+    return parse
+
+
+def _boolean(value: str) -> bool:
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise ValueError(f"must be one of {', '.join(TRUE_VALUES + FALSE_VALUES)}")
+
+
+def _choice(options):
+    def parse(value: str) -> str:
+        if value.lower() not in options:
+            raise ValueError(f"must be one of {', '.join(options)}")
+        return value.lower()
+    return parse
+
+
+def _setting(default, parse=None):
+    return field(default=default, metadata={"parse": parse})
+
+
+@dataclass(frozen=True)
+class AppSettings:
+    """
+    Typed, immutable snapshot of every row in the Settings table.
+    Values are parsed once when the snapshot loads, unset or empty rows take the default.
+    """
+    api_endpoint: Optional[str] = None
+    api_key: Optional[str] = None
+    api_model: Optional[str] = None
+    weave_key: Optional[str] = None
+    weave_project: Optional[str] = None
+    github_token: Optional[str] = None
+    figma_token: Optional[str] = None
+    api_timeout: float = _setting(DEFAULT_TIMEOUT, _number(1))
+    api_max_connections: int = _setting(DEFAULT_MAX_CONNECTIONS, _integer(1))
+    api_max_keepalive: int = _setting(DEFAULT_MAX_KEEPALIVE_CONNECTIONS, _integer(0))
+    review_concurrency: int = _setting(DEFAULT_REVIEW_CONCURRENCY, _integer(1))
+    tone_batch_size: int = _setting(DEFAULT_TONE_BATCH_SIZE, _integer(1))
+    speculative_streaming: bool = _setting(False, _boolean)
+    stream_flush_chars: int = _setting(FlushPolicy().max_chars, _integer(1))
+    stream_flush_ms: int = _setting(FlushPolicy().max_delay_ms, _integer(1))
+    figma_export_scale: float = _setting(DEFAULT_EXPORT_SCALE, _number(MIN_EXPORT_SCALE, MAX_EXPORT_SCALE))
+    figma_export_format: str = _setting(DEFAULT_EXPORT_FORMAT, _choice(EXPORT_FORMATS))
+    pr_max_results: int = _setting(DEFAULT_MAX_RESULTS, _integer(1))
+    github_repositories: Tuple[str, ...] = _setting(DEFAULT_REPOSITORIES, parse_repositories)
+    pr_sort: Optional[str] = _setting(None, _choice(SORT_ORDERS))
+
+    @classmethod
+    def keys(cls):
+        return [field.name for field in fields(cls)]
+
+    @classmethod
+    def parse(cls, key: str, value):
+        """Typed value of one setting, raising ValueError with the reason when it is invalid."""
+        field_info = {field.name: field for field in fields(cls)}[key]
+        value = "" if value is None else str(value).strip()
+        if not value:
+            return field_info.default
+        parse = field_info.metadata.get("parse")
+        return parse(value) if parse else value
+
+    @classmethod
+    def validate(cls, values: Dict[str, str]) -> Dict[str, str]:
+        """Reasons by key for every known setting in `values` that cannot be parsed."""
+        errors = {}
+        for key in cls.keys():
+            if key in values:
+                try:
+                    cls.parse(key, values[key])
+                except ValueError as e:
+                    errors[key] = str(e)
+        return errors
+
+    @classmethod
+    def from_values(cls, values: Dict[str, str]) -> "AppSettings":
+        parsed = {}
+        for key in cls.keys():
+            try:
+                parsed[key] = cls.parse(key, values.get(key))
+            except ValueError as e:
+                # Rows saved before validation existed fall back to the default instead of failing every request
+                logger.warning(f"Ignoring invalid setting {key}: {str(e)}")
+        return cls(**parsed)
+
+
+class SettingsCache:
+    """
+    Process-local settings snapshot.
+    The loader runs once (a single query) and the result is served until invalidate() is called on write.
+    """
+
+    def __init__(self, loader: Callable[[], Dict[str, str]]):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def _load(self) -> Tuple[Dict[str, str], AppSettings]:
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is None:
+                values = self._loader()
+                self._snapshot = (values, AppSettings.from_values(values))
+            return self._snapshot
+
+    def get(self) -> AppSettings:
+        return self._load()[1]
+
+    def values(self) -> Dict[str, str]:
+        """The stored values as saved, for the settings form."""
+        return dict(self._load()[0])
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+
+class TTLCache:
+    """Small thread-safe key/value cache where entries expire after `ttl` seconds."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,157 @@
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Generator, Iterable, List
+from logger import logger
+import metrics
+
+_registry_lock = threading.Lock()
+_flights = []
+
+
+def make_key(*parts) -> str:
+    """
+    Normalized key for a call: strings are stripped, dicts sorted and the result hashed,
+    so credentials in the arguments never appear in logs or metrics.
+    """
+    def normalize(value):
+        if isinstance(value, str):
+            return value.strip()
+        if isinstance(value, dict):
+            return {str(k): normalize(v) for k, v in sorted(value.items()) if v not in (None, "")}
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        return value
+
+    encoded = json.dumps(normalize(list(parts)), sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.result = None
+        self.waiters = 1
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: the first caller for a key runs the work,
+    callers arriving while it is in flight attach to it and share its result or stream.
+    Nothing is kept once the call completes, later callers start a new one.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        with _registry_lock:
+            _flights.append(self)
+
+    def _join(self, key: str):
+        """Return the in-flight call for a key and whether this caller leads it."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                with call.cond:
+                    call.waiters += 1
+                metrics.increment(f"single_flight.{self.name}.coalesced")
+                logger.info(f"Joined in-flight {self.name} call ({call.waiters} waiters)")
+                return call, False
+            call = _Call()
+            self._calls[key] = call
+        metrics.increment(f"single_flight.{self.name}.calls")
+        return call, True
+
+    def _finish(self, key: str, call: _Call):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        with call.cond:
+            call.done = True
+            call.cond.notify_all()
+
+    def _leave(self, call: _Call):
+        with call.cond:
+            call.waiters -= 1
+
+    def do(self, key: str, fn: Callable, *args, **kwargs) -> Any:
+        """Run `fn` once per key at a time and return its result (or raise its error) to every caller."""
+        call, leader = self._join(key)
+        if leader:
+            try:
+                call.result = fn(*args, **kwargs)
+            except Exception as e:
+                call.error = e
+            finally:
+                self._finish(key, call)
+        else:
+            with call.cond:
+                while not call.done:
+                    call.cond.wait()
+
+        self._leave(call)
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stream(self, key: str, factory: Callable[[], Iterable[str]]) -> Generator[str, None, None]:
+        """
+        Run a stream once per key at a time and replay it to every caller, including those that
+        join mid-way. The stream runs on its own thread, so it outlives any one caller,
+        and stops early only once every caller has gone away.
+        """
+        call, leader = self._join(key)
+
+        if leader:
+            def produce():
+                try:
+                    for chunk in factory():
+                        with call.cond:
+                            if call.waiters == 0:
+                                logger.info(f"Every caller left the {self.name} stream, stopping it")
+                                break
+                            call.chunks.append(chunk)
+                            call.cond.notify_all()
+                except Exception as e:
+                    call.error = e
+                finally:
+                    self._finish(key, call)
+
+            threading.Thread(target=produce, name=f"single-flight-{self.name}", daemon=True).start()
+
+        def consume():
+            position = 0
+            try:
+                while True:
+                    with call.cond:
+                        while position >= len(call.chunks) and not call.done:
+                            call.cond.wait()
+                        pending = call.chunks[position:]
+                        finished = call.done
+                    position += len(pending)
+                    yield from pending
+                    if finished and position >= len(call.chunks):
+                        break
+                if call.error is not None:
+                    raise call.error
+            finally:
+                self._leave(call)
+
+        return consume()
+
+    def in_flight(self) -> Dict[str, int]:
+        """Number of in-flight calls and of callers waiting on them."""
+        with self._lock:
+            calls = list(self._calls.values())
+        return {"in_flight": len(calls), "waiters": sum(call.waiters for call in calls)}
+
+
+def snapshot() -> Dict[str, Dict[str, int]]:
+    """In-flight calls and waiter counts of every single-flight group, for the metrics endpoint."""
+    with _registry_lock:
+        flights: List[SingleFlight] = list(_flights)
+    return {flight.name: flight.in_flight() for flight in flights}
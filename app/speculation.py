@@ -0,0 +1,64 @@
+import time
+from typing import Generator
+from background import QueuedStream, submit
+from logger import logger
+import metrics
+
+
+class SpeculativeStream:
+    """
+    Start a streamed conversational completion before routing has finished.
+    Tokens are held until commit() is called, and cancel() abandons the request if a tool was chosen instead.
+    """
+
+    def __init__(self, client, api_model: str, messages: list):
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+        self._client = client
+        self._api_model = api_model
+        self._messages = messages
+        self._deltas = QueuedStream(self._completion_deltas)
+        metrics.increment("speculation.started")
+        submit(self._deltas.run)
+
+    def _completion_deltas(self) -> Generator[str, None, None]:
+        stream = self._client.chat.completions.create(
+            model=self._api_model,
+            messages=self._messages,
+            stream=True
+        )
+        try:
+            for chunk in stream:
+                content = chunk.choices[0].delta.content
+                if content is not None:
+                    if self.first_token_at is None:
+                        self.first_token_at = time.monotonic()
+                    yield content
+        finally:
+            # Closing the response aborts the request upstream
+            stream.close()
+
+    def _record_latency_saved(self):
+        # Without speculation the first token arrives one full time-to-first-token after routing,
+        # with it the wait is shortened by whichever of routing time or time-to-first-token is smaller
+        routed_after = time.monotonic() - self.started_at
+        if self.first_token_at is not None:
+            saved = min(routed_after, self.first_token_at - self.started_at)
+        else:
+            saved = routed_after
+        metrics.observe("speculation.latency_saved_ms", saved * 1000)
+        return saved
+
+    def cancel(self):
+        """Abandon the speculative completion, the router chose a tool."""
+        self._deltas.stop()
+        metrics.increment("speculation.wasted")
+        metrics.observe("speculation.wasted_ms", (time.monotonic() - self.started_at) * 1000)
+        logger.info("Speculative conversation stream cancelled")
+
+    def commit(self) -> Generator[str, None, None]:
+        """Release the held tokens and continue with the live stream."""
+        metrics.increment("speculation.used")
+        saved = self._record_latency_saved()
+        logger.info(f"Speculative conversation stream used, saved {saved * 1000:.0f}ms")
+        yield from self._deltas.items()
@@ -0,0 +1,172 @@
+import threading
+import time
+from typing import Callable, Generator, Iterable, NamedTuple, Optional
+
+FENCE_MARKERS = ("```", "~~~")
+
+
+class FlushPolicy(NamedTuple):
+    """When buffered text is released to the client."""
+    # Flush every completed line
+    on_newline: bool = True
+    # Flush a partial line once this many characters are pending
+    max_chars: int = 80
+    # Flush a partial line once this long has passed since the last flush
+    max_delay_ms: int = 150
+
+
+_policy_lock = threading.Lock()
+_default_policy = FlushPolicy()
+
+
+def configure_flush_policy(max_chars=None, max_delay_ms=None, on_newline=None):
+    """Update the flush policy used when an agent does not pass its own."""
+    global _default_policy
+    with _policy_lock:
+        _default_policy = FlushPolicy(
+            on_newline=_default_policy.on_newline if on_newline is None else bool(on_newline),
+            max_chars=int(max_chars) if max_chars else FlushPolicy().max_chars,
+            max_delay_ms=int(max_delay_ms) if max_delay_ms else FlushPolicy().max_delay_ms,
+        )
+
+
+def default_flush_policy() -> FlushPolicy:
+    return _default_policy
+
+
+class StreamNormalizer:
+    """
+    Incrementally normalizes streamed model output.
+
+    Runs of spaces inside a line are collapsed and runs of blank lines are reduced to one,
+    while indentation and everything inside fenced code blocks is passed through untouched.
+    Every delta is processed once, so total work is linear in the size of the output.
+    """
+
+    def __init__(self, policy: Optional[FlushPolicy] = None):
+        self.policy = policy or default_flush_policy()
+        self._pending = ""
+        self._line_head = ""
+        self._line_started = False
+        self._pending_space = False
+        self._in_code = False
+        self._last_line_blank = True
+        self._held = ""
+        self._last_flush = time.monotonic()
+
+    def _emit_fragment(self, text: str) -> str:
+        """Normalize part of the current line; the caller guarantees it is the next text on the line."""
+        if self._in_code:
+            self._line_started = self._line_started or bool(text)
+            return text
+
+        out = ""
+        if not self._line_started:
+            stripped = text.lstrip(" \t")
+            if not stripped:
+                return ""
+            # Keep indentation, it is significant for nested lists
+            out = text[:len(text) - len(stripped)]
+            text = stripped
+            self._line_started = True
+            self._pending_space = False
+        elif text[:1].isspace():
+            self._pending_space = True
+
+        words = text.split()
+        if words:
+            out += (" " if self._pending_space else "") + " ".join(words)
+            self._pending_space = text[-1].isspace()
+        return out
+
+    def _complete_line(self, rest: str) -> str:
+        out = self._emit_fragment(rest)
+        line_head = (self._line_head + rest)[:16].lstrip()
+        is_fence = line_head.startswith(FENCE_MARKERS)
+
+        if self._in_code or self._line_started:
+            out += "\n"
+            self._last_line_blank = False
+        elif not self._last_line_blank:
+            # Collapse consecutive blank lines into one
+            out += "\n"
+            self._last_line_blank = True
+
+        if is_fence:
+            self._in_code = not self._in_code
+
+        self._line_head = ""
+        self._line_started = False
+        self._pending_space = False
+        return out
+
+    def _flush_partial(self) -> str:
+        text = self._pending
+        out = self._emit_fragment(text)
+        if out or self._line_started:
+            # Only the start of the line is needed to recognise code fences
+            if len(self._line_head) < 16:
+                self._line_head += text[:16 - len(self._line_head)]
+            self._pending = ""
+        return out
+
+    def feed(self, delta: str) -> str:
+        """Add a delta and return whatever text the flush policy releases."""
+        if not delta:
+            return ""
+
+        out = [self._held]
+        lines = (self._pending + delta).split("\n")
+        self._pending = lines.pop()
+        for line in lines:
+            out.append(self._complete_line(line))
+
+        now = time.monotonic()
+        due = (now - self._last_flush) * 1000 >= self.policy.max_delay_ms
+        if self._pending and (len(self._pending) >= self.policy.max_chars or due):
+            out.append(self._flush_partial())
+
+        text = "".join(out)
+        if not self.policy.on_newline and len(text) < self.policy.max_chars and not due:
+            # Completed lines alone do not trigger a flush
+            self._held = text
+            return ""
+
+        self._held = ""
+        if text:
+            self._last_flush = now
+        return text
+
+    def finish(self) -> str:
+        """Release any text still held back at the end of the stream."""
+        text = self._held + (self._emit_fragment(self._pending) if self._pending else "")
+        self._held = ""
+        self._pending = ""
+        return text
+
+
+def normalize_stream(deltas: Iterable[str], policy: Optional[FlushPolicy] = None) -> Generator[str, None, None]:
+    """Normalize an iterable of text deltas into flushed chunks."""
+    normalizer = StreamNormalizer(policy)
+    for delta in deltas:
+        text = normalizer.feed(delta)
+        if text:
+            yield text
+    text = normalizer.finish()
+    if text:
+        yield text
+
+
+def completion_deltas(stream, on_content: Callable[[str], None] = None) -> Generator[str, None, None]:
+    """Text deltas of a streamed chat completion, optionally passing each raw delta to `on_content`."""
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content is not None:
+            content = chunk.choices[0].delta.content
+            if on_content:
+                on_content(content)
+            yield content
+
+
+def stream_completion(stream, on_content: Callable[[str], None] = None, policy: Optional[FlushPolicy] = None) -> Generator[str, None, None]:
+    """Normalized, flushed text of a streamed chat completion."""
+    yield from normalize_stream(completion_deltas(stream, on_content), policy)
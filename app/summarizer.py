@@ -0,0 +1,85 @@
+from typing import Dict, List, Optional
+from context import count_message_tokens
+from logger import logger
+
+# Fold older messages into the summary once the unsummarized history is this large
+SUMMARY_THRESHOLD_TOKENS = 6000
+# Number of most recent messages that are always sent verbatim
+KEEP_RECENT_MESSAGES = 6
+
+SUMMARY_PROMPT = """
+You maintain a running summary of a conversation between a user and a design assistant.
+You will receive the current summary (which may be empty) and the messages that followed it.
+Return an updated summary that folds the new messages into the current one.
+
+## Keep:
+- The user's goals, decisions and open questions.
+- Figma files, frames and image links that were discussed, and which reviews were run on them.
+- Key findings from design, tone and pull request reviews, in short form.
+
+## Formatting:
+- Use short bullet points.
+- Do not nest bullet points.
+- Return only the summary.
+""".strip()
+
+
+def _history(thread_messages: list) -> List[Dict]:
+    return [msg for msg in thread_messages if msg["message"].strip()]
+
+
+def _unsummarized(thread_messages: list, summary_upto: Optional[str]) -> List[Dict]:
+    """Messages after the high-water mark, in thread order."""
+    history = _history(thread_messages)
+    if not summary_upto:
+        return history
+    for idx, msg in enumerate(history):
+        if msg.get("id") == summary_upto:
+            return history[idx + 1:]
+    # The high-water-mark message was deleted, KSUIDs still sort by creation time
+    return [msg for msg in history if msg.get("id") and msg["id"] > summary_upto]
+
+
+def apply_summary(thread_messages: list, thread_metadata: Dict) -> list:
+    """Replace everything up to the high-water mark with the thread's running summary."""
+    summary = (thread_metadata or {}).get("summary")
+    if not summary:
+        return thread_messages
+
+    recent = _unsummarized(thread_messages, thread_metadata.get("summary_upto"))
+    summary_message = {
+        "id": None,
+        "sender": "system",
+        "type": "summary",
+        "message": f"Summary of the earlier conversation:\n\n{summary}",
+        "metadata": {},
+        "pinned": True,
+    }
+    return [summary_message] + recent
+
+
+def messages_to_fold(thread_messages: list, thread_metadata: Dict, api_model: str) -> List[Dict]:
+    """Older unsummarized messages to fold into the summary, or an empty list while under the threshold."""
+    recent = _unsummarized(thread_messages, (thread_metadata or {}).get("summary_upto"))
+    if len(recent) <= KEEP_RECENT_MESSAGES:
+        return []
+
+    tokens = sum(count_message_tokens(msg, api_model) for msg in recent)
+    if tokens < SUMMARY_THRESHOLD_TOKENS:
+        return []
+    return recent[:-KEEP_RECENT_MESSAGES]
+
+
+def update_summary(client, api_model: str, summary: Optional[str], new_messages: List[Dict]) -> str:
+    """Fold new messages into the running summary with one completion."""
+    transcript = "\n\n".join(f"{msg['sender']}: {msg['message']}" for msg in new_messages)
+    logger.info(f"Folding {len(new_messages)} message(s) into the thread summary")
+
+    response = client.chat.completions.create(
+        model=api_model,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Current summary:\n\n{summary or '(empty)'}\n\nNew messages:\n\n{transcript}"},
+        ]
+    )
+    return response.choices[0].message.content.strip()
@@ -0,0 +1,316 @@
+import email.utils
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from logger import logger
+import metrics
+
+# Keep-alive pool per upstream, sized for the parallel export and download workers
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+DEFAULT_TIMEOUT = 60
+
+# Requests in flight at once per host
+HOST_CONCURRENCY = {
+    "api.github.com": 4,
+    "api.figma.com": 4,
+}
+DEFAULT_HOST_CONCURRENCY = 8
+
+# Retries of rate limited, failed or unreachable requests
+MAX_RETRIES = 4
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Longest a request waits on a rate limit, longer blocks fail fast so the caller can report them
+MAX_WAIT_SECONDS = 5.0
+
+# Below this many remaining requests the rest of the window is spread evenly until the reset
+PACING_THRESHOLD = 100
+
+# Conditional GET cache, bodies larger than this are not kept
+ETAG_CACHE_SIZE = 128
+ETAG_MAX_BODY_BYTES = 512 * 1024
+
+_lock = threading.Lock()
+_sessions = {}
+_hosts = {}
+_etags = OrderedDict()
+
+
+class RateLimitError(Exception):
+    """A host's rate limit blocks requests for longer than MAX_WAIT_SECONDS."""
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(name: str) -> requests.Session:
+    """
+    Shared requests session for an upstream service ("figma", "github", ...), created on first use.
+    Sessions keep connections alive between calls and are safe to share across worker threads.
+    """
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            logger.info(f"Creating pooled HTTP session for {name}")
+            session = _build_session()
+            _sessions[name] = session
+        return session
+
+
+class HostLimiter:
+    """
+    Per-host concurrency cap plus token-bucket pacing driven by the host's rate limit headers.
+
+    Until a host reports its limits requests are only capped by concurrency. Once the remaining
+    budget drops below PACING_THRESHOLD, tokens refill at remaining / seconds-until-reset, so the
+    rest of the window is spread out instead of exhausted in a burst. A Retry-After or an exhausted
+    budget blocks the host until the given time. Requests wait at most MAX_WAIT_SECONDS for their
+    turn, a longer wait raises RateLimitError instead.
+    """
+
+    def __init__(self, host: str, concurrency: int):
+        self.host = host
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._rate = None
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _wait_time(self) -> float:
+        """Seconds until a request may be sent, taking a token if one is available. Caller holds the lock."""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._rate is None:
+            return 0.0
+
+        self._tokens = min(1.0, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        return (1.0 - self._tokens) / self._rate
+
+    def acquire(self):
+        # Waits happen before taking a slot, a paced or blocked request never holds one up
+        waited = 0.0
+        while True:
+            with self._lock:
+                delay = self._wait_time()
+            if delay <= 0:
+                break
+            if waited + delay > MAX_WAIT_SECONDS:
+                metrics.increment("upstream.rate_limited")
+                raise RateLimitError(f"Rate limit of {self.host} reached, retry in {delay:.0f}s")
+            time.sleep(delay)
+            waited += delay
+        self._slots.acquire()
+        if waited:
+            logger.info(f"Paced request to {self.host} by {waited * 1000:.0f}ms")
+            metrics.observe("upstream.throttled_ms", waited * 1000)
+
+    def release(self):
+        self._slots.release()
+
+    def block_for(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def blocked_for(self) -> float:
+        """Seconds until the host accepts requests again."""
+        with self._lock:
+            return max(0.0, self._blocked_until - time.monotonic())
+
+    def update(self, headers):
+        """Adjust pacing from X-RateLimit-Remaining / X-RateLimit-Reset (epoch seconds)."""
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining = int(remaining)
+            seconds_left = max(1.0, float(reset) - time.time())
+        except ValueError:
+            return
+
+        with self._lock:
+            if remaining <= 0:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + seconds_left)
+                logger.warning(f"Rate limit of {self.host} exhausted, blocked {seconds_left:.0f}s until the reset")
+            elif remaining < PACING_THRESHOLD:
+                self._rate = remaining / seconds_left
+            else:
+                self._rate = None
+
+
+def _limiter(url: str) -> HostLimiter:
+    host = urlsplit(url).hostname or ""
+    limiter = _hosts.get(host)
+    if limiter is None:
+        with _lock:
+            limiter = _hosts.get(host)
+            if limiter is None:
+                limiter = HostLimiter(host, HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY))
+                _hosts[host] = limiter
+    return limiter
+
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    """Seconds from a Retry-After header, given either in seconds or as an HTTP date."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def _is_rate_limited(response: requests.Response) -> bool:
+    # GitHub reports primary and secondary limits as 403 with these headers
+    return response.status_code == 429 or (
+        response.status_code == 403
+        and (response.headers.get("Retry-After") or response.headers.get("X-RateLimit-Remaining") == "0")
+    )
+
+
+def _etag_key(url: str, params, headers: Dict) -> str:
+    # Credentials are part of the key, one token's cached response is never served to another
+    raw = repr((url, sorted((params or {}).items()), sorted((headers or {}).items())))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _from_cache(cached: Dict, url: str) -> requests.Response:
+    response = requests.Response()
+    response.status_code = cached["status_code"]
+    response._content = cached["content"]
+    response.headers.update(cached["headers"])
+    response.url = url
+    response.encoding = cached["encoding"]
+    return response
+
+
+def request(name: str, method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a request to an upstream service over its pooled session.
+
+    Requests are capped per host and paced from the rate limit headers. Rate limited (429, or GitHub's
+    403 with rate limit headers), 5xx and connection failures are retried with jittered exponential
+    backoff, waiting at least as long as any Retry-After. When the host is blocked for longer than
+    MAX_WAIT_SECONDS the rate limited response is returned as-is, and a request to a host that is
+    still blocked raises RateLimitError, so callers report the limit instead of hanging. GET responses with an ETag are revalidated with
+    If-None-Match, and a 304 is answered from the cached body, unless `conditional` is False.
+    Only idempotent calls go through here, GraphQL queries included.
+    """
+    conditional = kwargs.pop("conditional", True)
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    headers = dict(kwargs.pop("headers", None) or {})
+    session = get_session(name)
+    limiter = _limiter(url)
+
+    cache_key = None
+    cached = None
+    if conditional and method.upper() == "GET":
+        cache_key = _etag_key(url, kwargs.get("params"), headers)
+        with _lock:
+            cached = _etags.get(cache_key)
+            if cached is not None:
+                _etags.move_to_end(cache_key)
+        if cached is not None:
+            headers["If-None-Match"] = cached["etag"]
+
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            response = session.request(method, url, headers=headers, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= MAX_RETRIES:
+                raise
+            delay = _backoff(attempt)
+            logger.warning(f"{method} {url} failed ({str(e)}), retrying in {delay:.1f}s")
+            metrics.increment("upstream.retries")
+            attempt += 1
+            time.sleep(delay)
+            continue
+        finally:
+            limiter.release()
+
+        limiter.update(response.headers)
+
+        retryable = _is_rate_limited(response) or response.status_code in RETRY_STATUSES
+        if retryable and attempt < MAX_RETRIES:
+            retry_after = _retry_after(response)
+            if retry_after:
+                limiter.block_for(retry_after)
+            blocked = limiter.blocked_for()
+            if blocked > MAX_WAIT_SECONDS:
+                logger.warning(f"{method} {url} returned {response.status_code}, rate limited for {blocked:.0f}s")
+                metrics.increment("upstream.rate_limited")
+                break
+            delay = max(blocked, _backoff(attempt))
+            response.close()
+            logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+            metrics.increment("upstream.retries")
+            attempt += 1
+            time.sleep(delay)
+            continue
+        break
+
+    if cache_key is None:
+        return response
+
+    if response.status_code == 304 and cached is not None:
+        metrics.increment("upstream.not_modified")
+        return _from_cache(cached, url)
+
+    etag = response.headers.get("ETag")
+    if response.status_code == 200 and etag and len(response.content) <= ETAG_MAX_BODY_BYTES:
+        with _lock:
+            _etags[cache_key] = {
+                "etag": etag,
+                "status_code": response.status_code,
+                "content": response.content,
+                "headers": dict(response.headers),
+                "encoding": response.encoding,
+            }
+            _etags.move_to_end(cache_key)
+            while len(_etags) > ETAG_CACHE_SIZE:
+                _etags.popitem(last=False)
+    return response
+
+
+def get(name: str, url: str, **kwargs) -> requests.Response:
+    return request(name, "GET", url, **kwargs)
+
+
+def post(name: str, url: str, **kwargs) -> requests.Response:
+    return request(name, "POST", url, **kwargs)
@@ -0,0 +1,132 @@
+import base64
+import io
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Tuple
+from PIL import Image
+from image_store import image_store
+from logger import logger
+import metrics
+
+# Pixel budget per image, the model downsamples anything larger at high detail anyway
+MAX_PIXELS = 2048 * 768
+MAX_SIDE = 2048
+# Frames taller than this multiple of their width are split into overlapping crops
+TALL_RATIO = 2.5
+TILE_ASPECT = 1.5
+TILE_OVERLAP = 0.1
+# Images this small are sent at low detail
+LOW_DETAIL_MAX_SIDE = 512
+PROCESSED_CACHE_SIZE = 32
+
+
+class VisionImage(NamedTuple):
+    url: str
+    detail: str
+    width: int
+    height: int
+    tokens: int
+
+
+_lock = threading.Lock()
+_processed = OrderedDict()
+
+
+def estimate_image_tokens(width: int, height: int, detail: str) -> int:
+    """Image token cost using OpenAI's published tiling rules."""
+    if detail == "low":
+        return 85
+
+    # Fit inside 2048x2048, then scale the shortest side down to 768
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
+
+
+def _downscale(image: Image.Image) -> Image.Image:
+    width, height = image.size
+    scale = min(1.0, math.sqrt(MAX_PIXELS / (width * height)), MAX_SIDE / max(width, height))
+    if scale >= 1.0:
+        return image
+    return image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+
+
+def _tiles(image: Image.Image) -> List[Image.Image]:
+    """Split a very tall frame into overlapping crops that each keep a readable width."""
+    width, height = image.size
+    if height <= width * TALL_RATIO:
+        return [image]
+
+    tile_height = int(width * TILE_ASPECT)
+    step = int(tile_height * (1 - TILE_OVERLAP))
+    crops = []
+    top = 0
+    while True:
+        bottom = min(top + tile_height, height)
+        crops.append(image.crop((0, top, width, bottom)))
+        if bottom >= height:
+            break
+        top += step
+    return crops
+
+
+def _encode(image: Image.Image) -> VisionImage:
+    image = _downscale(image)
+    width, height = image.size
+    detail = "low" if max(width, height) <= LOW_DETAIL_MAX_SIDE else "high"
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    url = f"data:image/png;base64,{base64.b64encode(buffer.getvalue()).decode('ascii')}"
+    return VisionImage(url, detail, width, height, estimate_image_tokens(width, height, detail))
+
+
+def prepare_image(data: bytes) -> List[VisionImage]:
+    """Downscale, tile and pick the detail level for one image."""
+    with Image.open(io.BytesIO(data)) as image:
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        return [_encode(tile) for tile in _tiles(image)]
+
+
+def vision_content(image_url: str) -> Tuple[List[Dict], int]:
+    """
+    Chat content parts for an image link and the estimated image tokens.
+    Falls back to sending the image as-is when it cannot be processed locally.
+    """
+    try:
+        digest = image_store.resolve_or_fetch(image_url)
+
+        if digest:
+            with _lock:
+                images = _processed.get(digest)
+                if images is not None:
+                    _processed.move_to_end(digest)
+
+            if images is None:
+                data, _ = image_store.read(digest)
+                images = prepare_image(data)
+                with _lock:
+                    _processed[digest] = images
+                    while len(_processed) > PROCESSED_CACHE_SIZE:
+                        _processed.popitem(last=False)
+
+            tokens = sum(image.tokens for image in images)
+            logger.info(
+                f"Prepared {image_url} as {len(images)} image(s) "
+                f"({', '.join(f'{i.width}x{i.height} {i.detail}' for i in images)}), ~{tokens} image tokens"
+            )
+            metrics.observe("vision.image_tokens", tokens)
+            parts = [
+                {"type": "image_url", "image_url": {"url": image.url, "detail": image.detail}}
+                for image in images
+            ]
+            return parts, tokens
+    except Exception as e:
+        logger.warning(f"Could not preprocess {image_url}, sending it unchanged: {str(e)}")
+
+    return [{"type": "image_url", "image_url": {"url": image_store.vision_url(image_url)}}], 0